@@ -6,14 +6,19 @@ using sentence transformers, while preserving metadata for each question.
 """
 
 import json
+import orjson
 import os
-import pickle
-from typing import List, Dict, Any, Tuple, Optional, Union
+from typing import List, Dict, Any, Tuple, Optional, Union, Callable
 
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 
+try:
+    import faiss
+except ImportError:  # faiss is optional; searches fall back to a NumPy scan
+    faiss = None
+
 class QuestionEmbeddingGenerator:
     """
     A class to generate and manage embeddings for a question bank.
@@ -25,8 +30,9 @@ class QuestionEmbeddingGenerator:
     def __init__(
         self, 
         model_name: str = "all-MiniLM-L6-v2", 
-        embedding_path: str = "question_embeddings.pkl",
-        metadata_path: str = "question_metadata.json"
+        embedding_path: str = "question_embeddings.npy",
+        metadata_path: str = "question_metadata.json",
+        device: Optional[str] = None
     ):
         """
         Initialize the question embedding generator.
@@ -35,13 +41,17 @@ class QuestionEmbeddingGenerator:
             model_name: Name of the sentence transformer model to use
             embedding_path: Path to save/load embeddings
             metadata_path: Path to save/load metadata
+            device: Device to run the model on (e.g. "cuda" or "cpu"); chosen automatically if None
         """
         self.model_name = model_name
         self.embedding_path = embedding_path
         self.metadata_path = metadata_path
+        self.device = device
         self.model = None
         self.embeddings = None
         self.metadata = None
+        self._index = None
+        self._normed = None
         
     def load_question_bank(self, json_str_or_file: str) -> List[Dict[Any, Any]]:
         """
@@ -62,8 +72,8 @@ class QuestionEmbeddingGenerator:
         except (json.JSONDecodeError, TypeError):
             # If that fails, treat as a file path
             try:
-                with open(json_str_or_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(json_str_or_file, 'rb') as f:
+                    return orjson.loads(f.read())
             except:
                 raise ValueError("Input must be valid JSON string or path to JSON file")
     
@@ -86,25 +96,51 @@ class QuestionEmbeddingGenerator:
         
         return integrated_text
     
-    def generate_embeddings(self, questions: List[Dict]) -> Tuple[np.ndarray, List[Dict]]:
+    def _load_model(self) -> SentenceTransformer:
+        """
+        Load the sentence transformer model if it isn't loaded yet.
+        
+        On CUDA the model runs in half precision, which roughly doubles throughput.
+        
+        Returns:
+            The loaded SentenceTransformer model
+        """
+        if self.model is None:
+            self.model = SentenceTransformer(self.model_name, device=self.device)
+            if self.model.device.type == "cuda":
+                self.model = self.model.half()
+        return self.model
+    
+    def generate_embeddings(self, 
+                            questions: List[Dict], 
+                            batch_size: int = 128, 
+                            show_progress_bar: bool = True) -> Tuple[np.ndarray, List[Dict]]:
         """
         Generate embeddings for each question in the question bank.
         
         Args:
             questions: List of question dictionaries
+            batch_size: Number of questions encoded per model call
+            show_progress_bar: Whether to show a progress bar while encoding
             
         Returns:
             Tuple of (embeddings array, metadata list)
         """
         print(f"Loading SBERT model: {self.model_name}")
-        if self.model is None:
-            self.model = SentenceTransformer(self.model_name)
+        self._load_model()
         
         # Create integrated texts for embedding
         integrated_texts = [self._get_integrated_text(q) for q in questions]
         
         print(f"Generating embeddings for {len(questions)} questions...")
-        embeddings = self.model.encode(integrated_texts, show_progress_bar=True)
+        embeddings = self.model.encode(
+            integrated_texts, 
+            batch_size=batch_size, 
+            show_progress_bar=show_progress_bar, 
+            convert_to_numpy=True
+        )
+        # Store float32 regardless of the precision the model ran in
+        embeddings = embeddings.astype(np.float32, copy=False)
         
         # Create metadata for each question
         metadata = []
@@ -120,6 +156,8 @@ class QuestionEmbeddingGenerator:
             })
         
         self.embeddings = embeddings
+        self._index = None
+        self._normed = None
         self.metadata = metadata
         
         return embeddings, metadata
@@ -147,9 +185,12 @@ class QuestionEmbeddingGenerator:
         os.makedirs(os.path.dirname(emb_path) if os.path.dirname(emb_path) else '.', exist_ok=True)
         os.makedirs(os.path.dirname(meta_path) if os.path.dirname(meta_path) else '.', exist_ok=True)
         
-        # Save embeddings
-        with open(emb_path, 'wb') as f:
-            pickle.dump(self.embeddings, f)
+        # Save embeddings as a raw float32 .npy file, written to a temporary file first and then
+        # renamed over the original so a reader never sees a partly written file
+        tmp_path = emb_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.embeddings, dtype=np.float32))
+        os.replace(tmp_path, emb_path)
         
         # Save metadata
         with open(meta_path, 'w', encoding='utf-8') as f:
@@ -181,8 +222,10 @@ class QuestionEmbeddingGenerator:
         if not os.path.exists(emb_path):
             raise FileNotFoundError(f"Embedding file not found: {emb_path}")
         
-        with open(emb_path, 'rb') as f:
-            self.embeddings = pickle.load(f)
+        # Read the embeddings fully into memory so the file is not held open while cached
+        self.embeddings = np.load(emb_path)
+        self._index = None
+        self._normed = None
         
         # Load metadata
         if not os.path.exists(meta_path):
@@ -196,15 +239,51 @@ class QuestionEmbeddingGenerator:
         
         return self.embeddings, self.metadata
     
+    def _normalized_embeddings(self) -> np.ndarray:
+        """
+        Return the L2-normalized embeddings, computing them once per set of embeddings.
+        
+        Returns:
+            Float32 array of unit-length embedding rows
+        """
+        if self._normed is None:
+            normed = np.ascontiguousarray(self.embeddings, dtype=np.float32)
+            self._normed = normed / np.linalg.norm(normed, axis=1, keepdims=True)
+        return self._normed
+    
+    def _build_index(self):
+        """
+        Build a faiss index over the L2-normalized embeddings.
+        
+        Vectors are stored as 8-bit scalar-quantized codes, so the index takes a quarter
+        of the memory of the float32 embeddings and inner products equal cosine similarity.
+        
+        Returns:
+            The populated faiss index
+        """
+        normed = self._normalized_embeddings()
+        
+        index = faiss.IndexScalarQuantizer(
+            normed.shape[1], 
+            faiss.ScalarQuantizer.QT_8bit, 
+            faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(normed)
+        index.add(normed)
+        return index
+    
     def search_similar_questions(self, 
                                query: str, 
-                               top_k: int = 5) -> List[Dict]:
+                               top_k: int = 5,
+                               filter_fn: Optional[Callable[[Dict], bool]] = None) -> List[Dict]:
         """
         Find questions similar to the query text.
         
         Args:
             query: Query text to find similar questions for
             top_k: Number of top results to return
+            filter_fn: Optional predicate on a question's metadata; only questions it
+                accepts are ranked, so up to top_k matching results are returned
             
         Returns:
             List of dictionaries containing metadata and similarity scores
@@ -215,19 +294,60 @@ class QuestionEmbeddingGenerator:
         if self.embeddings is None or self.metadata is None:
             raise ValueError("No embeddings or metadata available. Generate or load embeddings first.")
         
-        if self.model is None:
-            self.model = SentenceTransformer(self.model_name)
+        self._load_model()
         
         # Generate embedding for the query
-        query_embedding = self.model.encode(query)
+        query_embedding = self.model.encode(query, convert_to_numpy=True).astype(np.float32, copy=False)
+        
+        query_normed = query_embedding / np.linalg.norm(query_embedding)
+        
+        # Positions of the questions accepted by the filter, if one is given
+        candidates = None
+        if filter_fn is not None:
+            candidates = np.fromiter(
+                (idx for idx, item in enumerate(self.metadata) if filter_fn(item)), 
+                dtype=np.int64
+            )
+            if len(candidates) == 0:
+                return []
+        
+        # Use the quantized faiss index when faiss is installed
+        if faiss is not None:
+            if self._index is None:
+                self._index = self._build_index()
+            
+            # Restrict the index scan to the accepted questions
+            params = None
+            if candidates is not None:
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(candidates))
+            
+            scores, indices = self._index.search(query_normed.reshape(1, -1), top_k, params=params)
+            
+            results = []
+            for score, idx in zip(scores[0], indices[0]):
+                if idx < 0:
+                    continue
+                result = self.metadata[idx].copy()
+                result["similarity_score"] = float(score)
+                results.append(result)
+            
+            return results
         
-        # Calculate cosine similarity
-        similarities = np.dot(self.embeddings, query_embedding) / (
-            np.linalg.norm(self.embeddings, axis=1) * np.linalg.norm(query_embedding)
-        )
+        # Calculate cosine similarity as one matrix-vector product over the normalized embeddings
+        similarities = self._normalized_embeddings() @ query_normed
+        
+        # Only rank the accepted questions
+        if candidates is None:
+            candidates = np.arange(len(similarities))
+        candidate_scores = similarities[candidates]
         
-        # Get top-k indices
-        top_indices = np.argsort(-similarities)[:top_k]
+        # Get top-k indices, only sorting the k candidates instead of every score
+        if top_k < len(candidate_scores):
+            top_positions = np.argpartition(-candidate_scores, top_k)[:top_k]
+            top_positions = top_positions[np.argsort(-candidate_scores[top_positions])]
+        else:
+            top_positions = np.argsort(-candidate_scores)[:top_k]
+        top_indices = candidates[top_positions]
         
         # Prepare results
         results = []
@@ -238,7 +358,11 @@ class QuestionEmbeddingGenerator:
         
         return results
     
-    def process_question_bank(self, question_bank_data: str, force_regenerate: bool = False) -> Tuple[np.ndarray, List[Dict]]:
+    def process_question_bank(self, 
+                              question_bank_data: str, 
+                              force_regenerate: bool = False, 
+                              batch_size: int = 128, 
+                              show_progress_bar: bool = True) -> Tuple[np.ndarray, List[Dict]]:
         """
         Process a question bank from start to finish.
         
@@ -250,6 +374,8 @@ class QuestionEmbeddingGenerator:
         Args:
             question_bank_data: JSON string or path containing question bank data
             force_regenerate: If True, regenerate embeddings even if they exist
+            batch_size: Number of questions encoded per model call
+            show_progress_bar: Whether to show a progress bar while encoding
             
         Returns:
             Tuple of (embeddings array, metadata list)
@@ -294,7 +420,11 @@ class QuestionEmbeddingGenerator:
         
         # Generate embeddings and metadata if needed
         if regenerate:
-            embeddings, metadata = self.generate_embeddings(questions)
+            embeddings, metadata = self.generate_embeddings(
+                questions, 
+                batch_size=batch_size, 
+                show_progress_bar=show_progress_bar
+            )
             
             # Save to disk
             self.save()
@@ -317,7 +447,7 @@ def main():
         # Initialize the generator
         generator = QuestionEmbeddingGenerator(
             model_name="all-MiniLM-L6-v2",
-            embedding_path="outputs/question_embeddings.pkl",
+            embedding_path="outputs/question_embeddings.npy",
             metadata_path="outputs/question_metadata.json"
         )
         
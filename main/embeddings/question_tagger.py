@@ -10,7 +10,6 @@ The script produces a JSON file organizing questions by main topic and subtopic.
 
 import os
 import json
-import pickle
 import numpy as np
 from typing import List, Dict, Any, Tuple
 from pathlib import Path
@@ -65,8 +64,7 @@ class QuestionTopicTagger:
             Tuple of (embeddings array, metadata list)
         """
         print(f"Loading question embeddings from {self.question_embedding_path}")
-        with open(self.question_embedding_path, 'rb') as f:
-            self.question_embeddings = pickle.load(f)
+        self.question_embeddings = np.load(self.question_embedding_path)
             
         print(f"Loading question metadata from {self.question_metadata_path}")
         with open(self.question_metadata_path, 'r', encoding='utf-8') as f:
@@ -326,7 +324,7 @@ def main():
     # Define paths
     base_dir = Path("D:/MSE_DS_JHU/Semester1/Information_Retrieval_Web_Agents/Git/DocuMagnetIR")
     
-    question_embedding_path = base_dir / "main/embeddings/question_embeddings.pkl"
+    question_embedding_path = base_dir / "main/embeddings/question_embeddings.npy"
     question_metadata_path = base_dir / "main/embeddings/question_metadata.json"
     syllabus_path = base_dir / "data/syllabus_extract_ocr/cs466_Syllabus/cs466_Syllabus_analyzed.json"
     output_path = base_dir / "results_question_bank/tagged_questions.json"
@@ -19,7 +19,7 @@ def main():
     # Initialize the generator
     generator = QuestionEmbeddingGenerator(
         model_name="all-MiniLM-L6-v2",  # You can change to a more powerful model if needed
-        embedding_path=os.path.join(output_dir, "question_embeddings.pkl"),
+        embedding_path=os.path.join(output_dir, "question_embeddings.npy"),
         metadata_path=os.path.join(output_dir, "question_metadata.json")
     )
     
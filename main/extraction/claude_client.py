@@ -0,0 +1,26 @@
+"""
+Shared Claude client setup for the post-processors.
+"""
+
+import httpx
+import anthropic
+
+
+def create_client(api_key):
+    """
+    Create an async Claude client whose requests and status polls share one pooled
+    HTTP/2 connection pool.
+    
+    Open it with async with for a single run, so the pool is closed before the event loop is.
+    
+    Args:
+        api_key (str): API key for Anthropic
+        
+    Returns:
+        anthropic.AsyncAnthropic: The client
+    """
+    http_client = anthropic.DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+    )
+    return anthropic.AsyncAnthropic(api_key=api_key, http_client=http_client)
\ No newline at end of file
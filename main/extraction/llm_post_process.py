@@ -1,17 +1,49 @@
 import os
-import json
-import glob
+import orjson
 import asyncio
 import time
 from pathlib import Path
-import anthropic
 from anthropic.types.message_create_params import MessageCreateParamsNonStreaming
 from anthropic.types.messages.batch_create_params import Request
 import streamlit as st
+from main.extraction.claude_client import create_client
+
+
+# Tool that forces Claude to return the located questions as structured JSON
+EMIT_QUESTIONS_TOOL = {
+    "name": "emit_questions",
+    "description": "Record the main questions located in the document, in order of appearance.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "questions": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "question_start": {"type": "string", "maxLength": 20},
+                        "question_type": {
+                            "enum": ["True/False", "Short Answer", "Theory", "Numerical", "Proof", "Comparison"]
+                        },
+                        "sub_questions_independent": {"type": ["boolean", "null"]}
+                    },
+                    "required": ["question_start", "question_type", "sub_questions_independent"]
+                }
+            }
+        },
+        "required": ["questions"]
+    }
+}
+EMIT_QUESTIONS_CHOICE = {"type": "tool", "name": "emit_questions"}
+
+# Fields of the plain-text response format, and the accepted values of the boolean one
+_RESPONSE_FIELDS = frozenset({"question_start", "question_type", "sub_questions_independent"})
+_INDEPENDENT_VALUES = {"true": True, "false": False}
 
 
 class ClaudePostProcessor:
-    def __init__(self, root_dir=None, api_key=None, batch_size=20, model="claude-3-5-haiku-20241022"):
+    def __init__(self, root_dir=None, api_key=None, batch_size=20, model="claude-3-5-haiku-20241022",
+                 max_concurrent_batches=3, max_batch_bytes=2 * 1024 * 1024):
         """
         Initialize the post-processor for processing .mmd files with Claude API.
         
@@ -20,15 +52,16 @@ class ClaudePostProcessor:
             api_key (str): API key for Anthropic
             batch_size (int): Maximum number of requests to process in a batch
             model (str): Claude model to use for processing
+            max_concurrent_batches (int): Maximum number of batches in flight at once
+            max_batch_bytes (int): Maximum combined size of the .mmd files in one batch
         """
         self.root_dir = root_dir if root_dir else self._get_project_root()
         self.api_key = st.secrets["ANTHROPIC_API_KEY"]
         self.batch_size = batch_size
+        self.max_concurrent_batches = max_concurrent_batches
+        self.max_batch_bytes = max_batch_bytes
         self.model = model
         
-        # Initialize the Claude client
-        self.client = anthropic.Anthropic(api_key=self.api_key)
-        
         # Set up directories
         self.ocr_results_dir = os.path.join(self.root_dir, "data", "ocr_results")
         self.prompt_path = os.path.join(self.root_dir, "prompts", "locate_classify_subques.txt")
@@ -45,17 +78,27 @@ class ClaudePostProcessor:
         """Load the prompt template from the specified file."""
         try:
             with open(self.prompt_path, 'r', encoding='utf-8') as file:
-                return file.read()
+                template = file.read()
         except FileNotFoundError:
             print(f"Error: Prompt file not found at {self.prompt_path}")
             return None
         
+        # Split once around the placeholder so each prompt is a plain concatenation
+        self._prompt_prefix, placeholder, self._prompt_suffix = template.partition("{{text_extract}}")
+        if not placeholder:
+            self._prompt_suffix = None
+        
+        return template
+        
     def _prepare_prompt(self, text_extract):
         """Prepare the prompt by replacing the placeholder with the actual text."""
         if not self.prompt_template:
             raise ValueError("Prompt template is not loaded")
         
-        return self.prompt_template.replace("{{text_extract}}", text_extract)
+        if self._prompt_suffix is None:
+            return self.prompt_template
+        
+        return self._prompt_prefix + text_extract + self._prompt_suffix
     
     def _extract_text_from_content(self, content):
         """
@@ -70,6 +113,10 @@ class ClaudePostProcessor:
         if isinstance(content, str):
             return content
         elif isinstance(content, list):
+            # Fast path for the usual single TextBlock response
+            if len(content) == 1 and hasattr(content[0], 'text'):
+                return content[0].text
+            
             # Concatenate all text blocks in the content list
             text_parts = []
             for item in content:
@@ -79,13 +126,41 @@ class ClaudePostProcessor:
                     text_parts.append(item.get('text', ''))
                 elif isinstance(item, str):
                     text_parts.append(item)
-            return ' '.join(text_parts)
+            return ''.join(text_parts)
         else:
             # Try to extract text if it has a 'text' attribute
             if hasattr(content, 'text'):
                 return content.text
             raise ValueError(f"Unexpected content format: {type(content)}")
     
+    def _extract_result(self, message):
+        """
+        Build the result dictionary from Claude's reply to a prompt.
+        
+        The emit_questions tool input is already parsed JSON, so it is used directly; the
+        plain-text parser is only a fallback for replies without a tool call.
+        
+        Args:
+            message: Claude's response message
+            
+        Returns:
+            dict: Structured dictionary with question information
+        """
+        for block in message.content:
+            if getattr(block, 'type', None) == 'tool_use' and block.name == EMIT_QUESTIONS_TOOL["name"]:
+                questions = block.input.get("questions") or []
+                return {
+                    str(question_num): {
+                        "question_start": question.get("question_start", ""),
+                        "question_type": question.get("question_type", ""),
+                        "sub_questions_independent": question.get("sub_questions_independent")
+                    }
+                    for question_num, question in enumerate(questions, 1)
+                }
+        
+        content_text = self._extract_text_from_content(message.content)
+        return self._parse_claude_response(content_text)
+    
     def _parse_claude_response(self, response):
         """
         Parse Claude's response into a structured dictionary.
@@ -109,48 +184,64 @@ class ClaudePostProcessor:
                 
             question_data = {}
             for line in lines:
-                if line.startswith("question_start:"):
-                    question_data["question_start"] = line.replace("question_start:", "").strip()
-                elif line.startswith("question_type:"):
-                    question_data["question_type"] = line.replace("question_type:", "").strip()
-                elif line.startswith("sub_questions_independent:"):
-                    value = line.replace("sub_questions_independent:", "").strip()
-                    if value == "true":
-                        question_data["sub_questions_independent"] = True
-                    elif value == "false":
-                        question_data["sub_questions_independent"] = False
-                    else:
-                        question_data["sub_questions_independent"] = None
+                # Split each line once on its first colon and keep the known fields
+                key, sep, value = line.partition(":")
+                if sep and key in _RESPONSE_FIELDS:
+                    question_data[key] = value.strip()
+            
+            if "sub_questions_independent" in question_data:
+                question_data["sub_questions_independent"] = _INDEPENDENT_VALUES.get(
+                    question_data["sub_questions_independent"]
+                )
             
             result[str(question_num)] = question_data
             question_num += 1
             
         return result
     
-    async def _process_file(self, file_path, pdf_name):
+    def _read_and_prepare(self, file_path):
+        """
+        Read an .mmd file and build its prompt.
+        
+        Args:
+            file_path (str): Path to the .mmd file
+            
+        Returns:
+            str: Prepared prompt for the file
+        """
+        # Read the raw bytes in one call, skipping the buffered text layer
+        text_extract = Path(file_path).read_bytes().decode('utf-8', 'replace')
+        
+        return self._prepare_prompt(text_extract)
+    
+    async def _process_file(self, client, file_path, pdf_name, prompt=None):
         """
         Process a single .mmd file with Claude API.
         
         Args:
+            client (anthropic.AsyncAnthropic): Claude client for the current run
             file_path (str): Path to the .mmd file
             pdf_name (str): Name of the PDF folder
+            prompt (str): Already prepared prompt for the file; read from disk if None
             
         Returns:
             tuple: (Success status, file path, result dictionary)
         """
         try:
-            # Read the content of the .mmd file
-            with open(file_path, 'r', encoding='utf-8') as file:
-                text_extract = file.read()
-            
-            # Prepare the prompt
-            prompt = self._prepare_prompt(text_extract)
+            if prompt is None:
+                # Read the content of the .mmd file in one call, skipping the buffered text layer
+                text_extract = Path(file_path).read_bytes().decode('utf-8', 'replace')
+                
+                # Prepare the prompt
+                prompt = self._prepare_prompt(text_extract)
             
             # Send to Claude API
-            message = self.client.messages.create(
+            message = await client.messages.create(
                 model=self.model,
                 max_tokens=8192,
                 temperature=0.2,
+                tools=[EMIT_QUESTIONS_TOOL],
+                tool_choice=EMIT_QUESTIONS_CHOICE,
                 messages=[
                     {
                         "role": "user",
@@ -159,61 +250,82 @@ class ClaudePostProcessor:
                 ]
             )
             
-            # Extract text content and parse the response
-            content_text = self._extract_text_from_content(message.content)
-            result = self._parse_claude_response(content_text)
+            # Read the structured tool input from the response
+            result = self._extract_result(message)
             
             return (True, file_path, result)
         except Exception as e:
             print(f"Error processing file {file_path}: {str(e)}")
             return (False, file_path, None)
     
-    async def _process_batch(self, batch_files):
+    async def _prepare_batch(self, batch_files):
         """
-        Process a batch of .mmd files using Claude's batch API.
+        Read the .mmd files of a batch and prepare their prompts concurrently in worker threads.
         
         Args:
             batch_files (list): List of tuples containing (file_path, pdf_name)
             
         Returns:
-            list: List of tuples with (success, file_path, result)
+            list: Prepared prompt (or the exception raised while reading) for each file
+        """
+        return await asyncio.gather(
+            *(asyncio.to_thread(self._read_and_prepare, file_path) for file_path, _ in batch_files),
+            return_exceptions=True
+        )
+    
+    async def _process_batch(self, client, batch_files, prompts):
+        """
+        Process a batch of .mmd files using Claude's batch API.
+        
+        Each result is written to disk as soon as it is streamed back, so only one
+        parsed result is held in memory at a time.
+        
+        Args:
+            client (anthropic.AsyncAnthropic): Claude client for the current run
+            batch_files (list): List of tuples containing (file_path, pdf_name)
+            prompts (list): Prepared prompts for the files, as returned by _prepare_batch
+            
+        Yields:
+            tuple: (success, file_path) for each processed file
         """
         # Create file_path map using custom_id as key
         file_path_map = {}
         batch_requests = []
+        done_files = set()
+        
+        # Build the shared request parameters once; each request only adds its messages
+        base_params = MessageCreateParamsNonStreaming(
+            model=self.model,
+            max_tokens=8192,
+            temperature=1,
+            tools=[EMIT_QUESTIONS_TOOL],
+            tool_choice=EMIT_QUESTIONS_CHOICE,
+            messages=[]
+        )
         
         # Prepare batch requests
-        for idx, (file_path, pdf_name) in enumerate(batch_files):
+        for idx, ((file_path, pdf_name), prompt) in enumerate(zip(batch_files, prompts)):
             try:
+                if isinstance(prompt, Exception):
+                    raise prompt
+                
                 # Create a unique custom_id for this file
                 custom_id = f"file_{idx}"
                 file_path_map[custom_id] = (file_path, pdf_name)
                 
-                # Read the content of the .mmd file
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    text_extract = file.read()
-                
-                # Prepare the prompt
-                prompt = self._prepare_prompt(text_extract)
-                
                 # Add to batch requests using the proper Request structure
-                from anthropic.types.message_create_params import MessageCreateParamsNonStreaming
-                from anthropic.types.messages.batch_create_params import Request
+                params = base_params.copy()
+                params["messages"] = [
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ]
                 
                 batch_requests.append(
                     Request(
                         custom_id=custom_id,
-                        params=MessageCreateParamsNonStreaming(
-                            model=self.model,
-                            max_tokens=8192,
-                            temperature=1,
-                            messages=[
-                                {
-                                    "role": "user",
-                                    "content": prompt
-                                }
-                            ]
-                        )
+                        params=params
                     )
                 )
             except Exception as e:
@@ -223,29 +335,33 @@ class ClaudePostProcessor:
         try:
             print(f"Creating batch with {len(batch_requests)} requests...")
             # Create the batch and get the batch ID
-            batch_response = self.client.messages.batches.create(requests=batch_requests)
+            batch_response = await client.messages.batches.create(requests=batch_requests)
             batch_id = batch_response.id
             
             print(f"Batch created with ID: {batch_id}")
             print(f"Initial status: {batch_response.processing_status}")
             
-            # Poll until the batch is complete (ended status)
-            max_polls = 60  # Maximum number of polling attempts
-            poll_interval = 10  # Seconds between polls
+            # Poll until the batch is complete (ended status), backing off exponentially
+            # so short batches are picked up quickly and long ones are not over-polled
+            deadline = time.monotonic() + 3600  # Give up after an hour of wall-clock time
+            delay = 1.0  # Seconds before the next poll, capped at 30
+            poll_count = 0
             
-            for i in range(max_polls):
+            while True:
                 # Get the current batch status
-                batch_status = self.client.messages.batches.retrieve(batch_id)
+                batch_status = await client.messages.batches.retrieve(batch_id)
+                poll_count += 1
                 
-                print(f"Polling batch status ({i+1}/{max_polls}): {batch_status.processing_status}")
+                print(f"Polling batch status (poll {poll_count}): {batch_status.processing_status}")
                 print(f"Counts: {batch_status.request_counts}")
                 
-                # Check if processing has ended
-                if batch_status.processing_status == "ended":
+                # Check if processing has ended or we ran out of time
+                if batch_status.processing_status == "ended" or time.monotonic() >= deadline:
                     break
                 
                 # Wait before polling again
-                await asyncio.sleep(poll_interval)
+                await asyncio.sleep(delay)
+                delay = min(delay * 1.5, 30.0)
             
             # Check if the batch completed successfully
             if batch_status.processing_status != "ended":
@@ -253,11 +369,10 @@ class ClaudePostProcessor:
                 raise TimeoutError("Batch processing timed out")
             
             # Process the results
-            results = []
             print("Processing batch results...")
             
             # Stream the results from the batch
-            for result in self.client.messages.batches.results(batch_id):
+            async for result in await client.messages.batches.results(batch_id):
                 custom_id = result.custom_id
                 file_path, pdf_name = file_path_map.get(custom_id, (None, None))
                 
@@ -265,17 +380,18 @@ class ClaudePostProcessor:
                     print(f"Warning: Could not find file path for custom_id {custom_id}")
                     continue
                 
+                success = False
                 if result.result.type == "succeeded":
                     try:
-                        # Extract text content from the message
-                        message = result.result.message
-                        content_text = self._extract_text_from_content(message.content)
-                        parsed_result = self._parse_claude_response(content_text)
-                        results.append((True, file_path, parsed_result))
-                        print(f"Successfully processed: {file_path}")
+                        # Read the structured tool input from the message
+                        parsed_result = self._extract_result(result.result.message)
+                        if parsed_result:
+                            # Write the result straight away instead of collecting it
+                            self._save_result(file_path, parsed_result)
+                            success = True
+                            print(f"Successfully processed: {file_path}")
                     except Exception as e:
                         print(f"Error parsing result for {file_path}: {str(e)}")
-                        results.append((False, file_path, None))
                 else:
                     # Handle error cases
                     error_type = result.result.type
@@ -284,78 +400,183 @@ class ClaudePostProcessor:
                         error_message = result.result.error.message if hasattr(result.result.error, "message") else str(result.result.error)
                     
                     print(f"Failed to process {file_path}: {error_type} - {error_message}")
-                    results.append((False, file_path, None))
-            
-            return results
+                
+                done_files.add(file_path)
+                yield (success, file_path)
         except Exception as e:
             print(f"Error processing batch: {str(e)}")
-            # Fall back to individual processing if batch fails
+            # Fall back to individual processing for files the batch did not cover
             print("Falling back to individual processing...")
-            results = []
-            for file_path, pdf_name in batch_files:
-                result = await self._process_file(file_path, pdf_name)
-                results.append(result)
-            return results
+            for (file_path, pdf_name), prompt in zip(batch_files, prompts):
+                if file_path in done_files:
+                    continue
+                
+                # Reuse the prompt prepared for the batch instead of re-reading the file
+                if isinstance(prompt, Exception):
+                    prompt = None
+                
+                success, file_path, result = await self._process_file(client, file_path, pdf_name, prompt)
+                if success and result:
+                    self._save_result(file_path, result)
+                    yield (True, file_path)
+                else:
+                    yield (False, file_path)
     
-    async def run(self):
+    def _find_pending_files(self):
         """
-        Run the post-processing pipeline on all .mmd files.
+        Find all .mmd files that do not have a _post1.json result yet.
         
         Returns:
-            tuple: (success count, failure count, skipped count)
+            tuple: (list of (file_path, pdf_folder) tuples to process, skipped count)
         """
-        success_count = 0
-        failure_count = 0
         skipped_count = 0
         
-        # Get all PDF folders in the OCR results directory
-        pdf_folders = [f for f in os.listdir(self.ocr_results_dir) 
-                      if os.path.isdir(os.path.join(self.ocr_results_dir, f))]
+        # Get all PDF folders in the OCR results directory; scandir caches the entry
+        # type so no extra stat is needed per folder
+        with os.scandir(self.ocr_results_dir) as entries:
+            pdf_folders = [entry.name for entry in entries if entry.is_dir(follow_symlinks=False)]
         
         # Prepare a list of all .mmd files to process
         all_files = []
         for pdf_folder in pdf_folders:
             folder_path = os.path.join(self.ocr_results_dir, pdf_folder)
-            mmd_files = glob.glob(os.path.join(folder_path, "*.mmd"))
             
-            for file_path in mmd_files:
-                # Check if post1.json already exists for this file
-                file_base_name = os.path.basename(file_path).replace('.mmd', '')
-                post1_path = os.path.join(folder_path, f"{file_base_name}_post1.json")
+            # Collect the .mmd files and existing file names in a single directory pass
+            with os.scandir(folder_path) as entries:
+                file_names = {entry.name for entry in entries if entry.is_file()}
+            mmd_files = sorted(name for name in file_names if name.endswith('.mmd'))
+            
+            for mmd_name in mmd_files:
+                file_path = os.path.join(folder_path, mmd_name)
                 
-                if os.path.exists(post1_path):
+                # Check if post1.json already exists for this file
+                file_base_name = mmd_name.replace('.mmd', '')
+                if f"{file_base_name}_post1.json" in file_names:
                     print(f"Skipping {file_path} - post1.json already exists")
                     skipped_count += 1
                     continue
                 
                 all_files.append((file_path, pdf_folder))
         
+        return all_files, skipped_count
+    
+    def _pack_batches(self, all_files):
+        """
+        Group files into batches of similar size.
+        
+        Files are sorted by size (largest first) and packed greedily, starting a new
+        batch once it holds batch_size files or adding the next file would exceed
+        max_batch_bytes. A single file larger than max_batch_bytes gets its own batch.
+        
+        Args:
+            all_files (list): List of tuples containing (file_path, pdf_name)
+            
+        Returns:
+            list: List of batches, each a list of (file_path, pdf_name) tuples
+        """
+        sized_files = sorted(
+            ((os.path.getsize(file_path), (file_path, pdf_name)) for file_path, pdf_name in all_files),
+            key=lambda item: item[0],
+            reverse=True
+        )
+        
+        batches = []
+        current_batch = []
+        current_bytes = 0
+        
+        for size, file_info in sized_files:
+            if current_batch and (len(current_batch) >= self.batch_size or
+                                  current_bytes + size > self.max_batch_bytes):
+                batches.append(current_batch)
+                current_batch = []
+                current_bytes = 0
+            
+            current_batch.append(file_info)
+            current_bytes += size
+        
+        if current_batch:
+            batches.append(current_batch)
+        
+        return batches
+    
+    def _save_result(self, file_path, result):
+        """
+        Save a parsed result next to its .mmd file.
+        
+        Args:
+            file_path (str): Path to the processed .mmd file
+            result (dict): Parsed result to save
+        """
+        # Get the PDF name from the file path
+        pdf_name = os.path.basename(os.path.dirname(file_path))
+        
+        # Get the base name of the .mmd file (without extension)
+        file_base_name = os.path.basename(file_path).replace('.mmd', '')
+        
+        # Create output file path
+        output_file = os.path.join(self.ocr_results_dir, pdf_name, f"{file_base_name}_post1.json")
+        
+        # Save the result as JSON
+        Path(output_file).write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+    
+    async def run(self):
+        """
+        Run the post-processing pipeline on all .mmd files.
+        
+        Returns:
+            tuple: (success count, failure count, skipped count)
+        """
+        success_count = 0
+        failure_count = 0
+        
+        # Scan the OCR results directory without blocking the event loop
+        all_files, skipped_count = await asyncio.to_thread(self._find_pending_files)
+        
         print(f"Found {len(all_files)} files to process, {skipped_count} files skipped")
         
-        # Process files in batches
-        for i in range(0, len(all_files), self.batch_size):
-            batch = all_files[i:i + self.batch_size]
-            batch_results = await self._process_batch(batch)
+        # Group files of similar size
+        batches = await asyncio.to_thread(self._pack_batches, all_files)
+        
+        # A producer reads and prepares batches ahead while up to max_concurrent_batches
+        # consumers submit and poll them; the bounded queue caps how many prepared
+        # batches are held in memory
+        queue = asyncio.Queue(maxsize=self.max_concurrent_batches)
+        
+        async def producer():
+            for batch in batches:
+                prompts = await self._prepare_batch(batch)
+                await queue.put((batch, prompts))
             
-            # Save results and update counts
-            for success, file_path, result in batch_results:
-                if success and result:
-                    # Get the PDF name from the file path
-                    pdf_name = os.path.basename(os.path.dirname(file_path))
-                    
-                    # Get the base name of the .mmd file (without extension)
-                    file_base_name = os.path.basename(file_path).replace('.mmd', '')
-                    
-                    # Create output file path
-                    output_file = os.path.join(self.ocr_results_dir, pdf_name, f"{file_base_name}_post1.json")
-                    
-                    # Save the result as JSON
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        json.dump(result, f, indent=2)
-                    
-                    success_count += 1
-                else:
-                    failure_count += 1
+            # One stop marker per consumer
+            for _ in range(self.max_concurrent_batches):
+                await queue.put(None)
+        
+        async def consumer(client):
+            batch_success = 0
+            batch_failure = 0
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return batch_success, batch_failure
+                
+                batch, prompts = item
+                # Results are saved as they stream in, so only tally them here
+                async for success, _ in self._process_batch(client, batch, prompts):
+                    if success:
+                        batch_success += 1
+                    else:
+                        batch_failure += 1
+        
+        # Open the client for this run only, so its connection pool is closed before the event loop is
+        async with create_client(self.api_key) as client:
+            _, *batch_counts = await asyncio.gather(
+                producer(),
+                *(consumer(client) for _ in range(self.max_concurrent_batches))
+            )
+        
+        for batch_success, batch_failure in batch_counts:
+            success_count += batch_success
+            failure_count += batch_failure
         
         return success_count, failure_count, skipped_count
 
@@ -1,6 +1,9 @@
 import httpx
 import asyncio
+import importlib.util
 import json
+import orjson
+import logging
 import os
 import time
 import traceback
@@ -9,19 +12,24 @@ from dotenv import load_dotenv
 import streamlit as st
 
 
+logger = logging.getLogger(__name__)
+
+
 class MathpixExtractor:
     """
     A class to handle the extraction of text and math from PDFs using Mathpix API.
     Processes all PDFs in a specified directory and keeps track of already processed files.
     """
 
-    def __init__(self, input_dir="DocuMagnetIR/data/sample_papers", output_dir="DocuMagnetIR/data/ocr_results"):
+    def __init__(self, input_dir="DocuMagnetIR/data/sample_papers", output_dir="DocuMagnetIR/data/ocr_results",
+                 max_concurrent_pdfs=4):
         """
         Initialize the MathpixExtractor with input and output directories.
         
         Args:
             input_dir (str): Directory containing PDFs to process
             output_dir (str): Directory to save extraction results
+            max_concurrent_pdfs (int): Maximum number of PDFs processed at once (Mathpix rate limit)
         """
         # Load environment variables from .env file
         env_path = ".env"
@@ -37,6 +45,7 @@ class MathpixExtractor:
         self.BASE_URL = "https://api.mathpix.com/v3/pdf"
         self.MAX_RETRIES = 5
         self.RETRY_DELAY = 5  # seconds
+        self.max_concurrent_pdfs = max_concurrent_pdfs
         
         # Set up directories
         self.input_dir = input_dir
@@ -77,6 +86,9 @@ class MathpixExtractor:
             }
         }
         
+        # Serialize the options once; they are sent unchanged with every upload
+        self.options_json = json.dumps(self.options, separators=(',', ':'))
+        
         # Load or initialize processed files map
         self.processed_files = self._load_processed_files()
 
@@ -101,11 +113,28 @@ class MathpixExtractor:
         with open(self.processed_file_map, 'w') as f:
             json.dump(self.processed_files, f, indent=2)
 
-    async def upload_pdf_file(self, file_path):
+    def _create_client(self):
+        """
+        Create the HTTP client shared by all Mathpix requests for a PDF.
+        
+        Reusing one client keeps the connection (and its TLS session) warm across the
+        upload, status polls, stream and downloads; HTTP/2 is used when h2 is installed.
+        
+        Returns:
+            httpx.AsyncClient: Client with the Mathpix auth header set
+        """
+        return httpx.AsyncClient(
+            http2=importlib.util.find_spec("h2") is not None,
+            timeout=httpx.Timeout(60.0),
+            headers={"app_key": self.app_key}
+        )
+
+    async def upload_pdf_file(self, client, file_path):
         """
         Uploads a PDF file from the local filesystem for processing and retrieves the `pdf_id`.
         
         Args:
+            client (httpx.AsyncClient): Shared Mathpix client
             file_path (str): Path to the PDF file
             
         Returns:
@@ -113,72 +142,66 @@ class MathpixExtractor:
         """
         print(f"Uploading PDF: {file_path}")
         
-        headers = {"app_key": self.app_key}
-        
-        # For file uploads, we need to use multipart/form-data
-        files = {"file": open(file_path, "rb")}
-        
         # Add streaming parameter
-        data = {"options_json": json.dumps(self.options)}
+        data = {"options_json": self.options_json}
         
         try:
-            async with httpx.AsyncClient() as client:
+            # For file uploads, we need to use multipart/form-data; httpx reads the open
+            # handle in chunks while sending, and the with block closes it afterwards
+            with open(file_path, "rb") as pdf_file:
+                files = {"file": (Path(file_path).name, pdf_file, "application/pdf")}
                 response = await client.post(
                     self.BASE_URL, 
-                    headers=headers, 
                     files=files, 
                     data=data
                 )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    print(f"PDF uploaded successfully with ID: {data.get('pdf_id')}")
-                    return data.get("pdf_id")
-                else:
-                    print(f"Failed to upload PDF: {response.status_code}, {response.text}")
-                    return None
+            
+            if response.status_code == 200:
+                data = response.json()
+                print(f"PDF uploaded successfully with ID: {data.get('pdf_id')}")
+                return data.get("pdf_id")
+            else:
+                print(f"Failed to upload PDF: {response.status_code}, {response.text}")
+                return None
         except Exception as e:
             print(f"Error uploading PDF: {e}")
             print(traceback.format_exc())
             return None
-        finally:
-            # Make sure to close the file
-            if 'files' in locals() and 'file' in files:
-                files['file'].close()
 
-    async def check_processing_status(self, pdf_id):
+    async def check_processing_status(self, client, pdf_id):
         """
         Checks the processing status of a PDF.
         
         Args:
+            client (httpx.AsyncClient): Shared Mathpix client
             pdf_id (str): The ID of the PDF to check
             
         Returns:
             dict or None: Status information if successful, None otherwise
         """
         url = f"{self.BASE_URL}/{pdf_id}"
-        headers = {"app_key": self.app_key}
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, headers=headers)
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    print(f"Failed to check status: {response.status_code}, {response.text}")
-                    return None
+            response = await client.get(url)
+            if response.status_code == 200:
+                return response.json()
+            else:
+                print(f"Failed to check status: {response.status_code}, {response.text}")
+                return None
         except Exception as e:
             print(f"Error checking status: {e}")
             return None
 
-    async def wait_for_processing(self, pdf_id, max_attempts=12, delay=5):
+    async def wait_for_processing(self, client, pdf_id, max_attempts=12, delay=1.0, max_delay=10.0):
         """
-        Waits for the PDF processing to complete by polling the status.
+        Waits for the PDF processing to complete by polling the status with exponential backoff.
         
         Args:
+            client (httpx.AsyncClient): Shared Mathpix client
             pdf_id (str): The ID of the PDF being processed
             max_attempts (int): Maximum number of status check attempts
-            delay (int): Seconds to wait between attempts
+            delay (float): Seconds to wait after the first attempt
+            max_delay (float): Upper bound for the wait between attempts
             
         Returns:
             bool: True if processing completed, False if timed out or failed
@@ -188,11 +211,12 @@ class MathpixExtractor:
         for attempt in range(1, max_attempts + 1):
             print(f"Attempt {attempt}/{max_attempts}: ", end="")
             
-            status_data = await self.check_processing_status(pdf_id)
+            status_data = await self.check_processing_status(client, pdf_id)
             
             if not status_data:
                 print("Failed to get status")
                 await asyncio.sleep(delay)
+                delay = min(delay * 1.6, max_delay)
                 continue
             
             status = status_data.get("status")
@@ -207,49 +231,73 @@ class MathpixExtractor:
                     print(f"Error details: {status_data['error']}")
                 return False
             else:
-                print(f"Processing in progress ({status})... waiting {delay} seconds")
+                print(f"Processing in progress ({status})... waiting {delay:.1f} seconds")
                 await asyncio.sleep(delay)
+                delay = min(delay * 1.6, max_delay)
         
         print("Timed out waiting for processing to complete")
         return False
 
-    async def stream_pdf(self, pdf_id):
+    async def _iter_stream_lines(self, response):
+        """
+        Yield the raw lines of a streaming response as bytes, without decoding them to text.
+        
+        Args:
+            response (httpx.Response): The open streaming response
+            
+        Yields:
+            bytes: One line of the stream (without the trailing newline)
+        """
+        # Read in large chunks and grow a bytearray in place, so a long line spread over
+        # many chunks is not copied again every time a chunk arrives
+        buffer = bytearray()
+        async for chunk in response.aiter_bytes(chunk_size=64 * 1024):
+            buffer.extend(chunk)
+            start = 0
+            while (newline := buffer.find(b"\n", start)) != -1:
+                yield bytes(buffer[start:newline])
+                start = newline + 1
+            if start:
+                del buffer[:start]
+        
+        if buffer:
+            yield bytes(buffer)
+
+    async def stream_pdf(self, client, pdf_id):
         """
         Streams the processed PDF data using the `pdf_id`.
         
         Args:
+            client (httpx.AsyncClient): Shared Mathpix client
             pdf_id (str): The ID of the PDF to stream
             
         Returns:
             list: List of JSON chunks from the stream
         """
         url = f"{self.BASE_URL}/{pdf_id}/stream"
-        headers = {"app_key": self.app_key}
         
         print(f"Starting streaming for PDF ID: {pdf_id}")
         results = []
         
         try:
-            async with httpx.AsyncClient(timeout=httpx.Timeout(timeout=None)) as client:
-                async with client.stream("GET", url, headers=headers) as response:
-                    if response.status_code == 200:
-                        print("Connected to the stream!")
-                        async for line in response.aiter_lines():
-                            if line.strip():  # Ignore empty lines
-                                try:
-                                    data = json.loads(line)
-                                    # Store the complete result
-                                    results.append(data)
-                                    
-                                    # Print a preview (only first 50 chars of text if available)
-                                    preview = data.copy()
-                                    if 'text' in preview and isinstance(preview['text'], str) and len(preview['text']) > 50:
-                                        preview['text'] = preview['text'][:50] + "..."
-                                    print(f"Received chunk: {preview}")
-                                except json.JSONDecodeError:
-                                    print(f"Failed to decode line: {line}")
-                    else:
-                        print(f"Failed to connect to stream: {response.status_code}, {response.text}")
+            # The stream stays open until Mathpix finishes, so it must not time out
+            async with client.stream("GET", url, timeout=httpx.Timeout(None)) as response:
+                if response.status_code == 200:
+                    print("Connected to the stream!")
+                    async for line in self._iter_stream_lines(response):
+                        if line.strip():  # Ignore empty lines
+                            try:
+                                data = orjson.loads(line)
+                                # Store the complete result
+                                results.append(data)
+                                
+                                # Log a short preview of the chunk text only when debugging
+                                if logger.isEnabledFor(logging.DEBUG):
+                                    logger.debug("Received chunk text=%s", (data.get('text') or '')[:50])
+                            except ValueError:
+                                print(f"Failed to decode line: {line.decode('utf-8', 'replace')}")
+                else:
+                    print(f"Failed to connect to stream: {response.status_code}, {response.text}")
             
             return results
         except Exception as e:
@@ -257,6 +305,37 @@ class MathpixExtractor:
             print(traceback.format_exc())
             return []
 
+    def _write_result_files(self, results, output_dir, file_name):
+        """
+        Write the streamed results JSON and the extracted MMD content to disk.
+        
+        Args:
+            results (list): List of JSON chunks from streaming
+            output_dir (str): Directory to save results
+            file_name (str): Base name for output files
+            
+        Returns:
+            tuple: (JSON file path, MMD file path)
+        """
+        # Save the JSON results for reference, compactly encoded since only code reads them
+        json_file = os.path.join(output_dir, f"{file_name}_results.json")
+        with open(json_file, 'wb') as f:
+            f.write(orjson.dumps(results))
+        
+        # Extract text content from streaming results and save as MMD
+        mmd_parts = []
+        for chunk in results:
+            text = chunk.get('text')
+            if text:
+                mmd_parts.append(text)
+        
+        # Save MMD content, writing the parts directly instead of concatenating them
+        mmd_file = os.path.join(output_dir, f"{file_name}.mmd")
+        with open(mmd_file, 'w', encoding='utf-8') as f:
+            f.writelines(mmd_parts)
+        
+        return json_file, mmd_file
+
     async def save_results(self, results, output_dir, file_name):
         """
         Saves the results to files and extracts MMD content.
@@ -272,22 +351,9 @@ class MathpixExtractor:
         os.makedirs(output_dir, exist_ok=True)
         
         try:
-            # Save the JSON results for reference
-            json_file = os.path.join(output_dir, f"{file_name}_results.json")
-            with open(json_file, 'w', encoding='utf-8') as f:
-                json.dump(results, f, indent=2)
+            # Write the files in a worker thread so the event loop is not blocked
+            json_file, mmd_file = await asyncio.to_thread(self._write_result_files, results, output_dir, file_name)
             print(f"Results saved to {json_file}")
-            
-            # Extract text content from streaming results and save as MMD
-            mmd_content = ""
-            for chunk in results:
-                if 'text' in chunk:
-                    mmd_content += chunk['text']
-            
-            # Save MMD content
-            mmd_file = os.path.join(output_dir, f"{file_name}.mmd")
-            with open(mmd_file, 'w', encoding='utf-8') as f:
-                f.write(mmd_content)
             print(f"MMD content extracted and saved to {mmd_file}")
             
             return True
@@ -296,11 +362,12 @@ class MathpixExtractor:
             print(traceback.format_exc())
             return False
 
-    async def download_conversion_formats(self, pdf_id, output_dir, file_name):
+    async def download_conversion_formats(self, client, pdf_id, output_dir, file_name):
         """
         Downloads available conversion formats directly from Mathpix API endpoints.
         
         Args:
+            client (httpx.AsyncClient): Shared Mathpix client
             pdf_id (str): The ID of the processed PDF
             output_dir (str): Directory to save downloaded formats
             file_name (str): Base name for output files
@@ -311,7 +378,7 @@ class MathpixExtractor:
         print(f"Waiting for processing to complete before downloading formats...")
         
         # Wait for processing to complete
-        processing_complete = await self.wait_for_processing(pdf_id)
+        processing_complete = await self.wait_for_processing(client, pdf_id)
         if not processing_complete:
             print("Processing did not complete. Some formats may not be available.")
         
@@ -327,47 +394,59 @@ class MathpixExtractor:
             {"ext": "lines.mmd.json", "binary": False}
         ]
         
-        success = False
-        
-        for format_info in formats:
+        async def _fetch(format_info):
             ext = format_info["ext"]
             is_binary = format_info["binary"]
             
             url = f"{self.BASE_URL}/{pdf_id}.{ext}"
-            headers = {"app_key": self.app_key}
+            
+            # Determine the output filename
+            output_filename = f"{file_name}.{ext}"
+            if ext == "tex":
+                output_filename = f"{file_name}.tex.zip"
+            
+            output_path = Path(output_dir) / output_filename
+            etag_path = output_path.with_name(output_path.name + ".etag")
+            
+            # Send the ETag of the copy already on disk so an unchanged file is not re-sent
+            headers = {}
+            if output_path.exists() and etag_path.exists():
+                headers["If-None-Match"] = etag_path.read_text(encoding="utf-8")
             
             print(f"Requesting {ext} format...")
             
             try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(url, headers=headers)
-                    
-                    if response.status_code == 200:
-                        # Determine the output filename
-                        output_filename = f"{file_name}.{ext}"
-                        if ext == "tex":
-                            output_filename = f"{file_name}.tex.zip"
-                        
-                        output_path = os.path.join(output_dir, output_filename)
-                        
-                        # Save the content
-                        if is_binary:
-                            with open(output_path, "wb") as f:
-                                f.write(response.content)
-                        else:
-                            with open(output_path, "w", encoding="utf-8") as f:
-                                f.write(response.text)
-                        
-                        print(f"Downloaded {ext} format to {output_path}")
-                        success = True
-                    else:
-                        print(f"Failed to download {ext} format: {response.status_code}, {response.text}")
+                response = await client.get(url, headers=headers)
                 
+                if response.status_code == 304:
+                    print(f"{ext} format is unchanged at {output_path}")
+                    return True
+                elif response.status_code == 200:
+                    # Save the content in a worker thread so the other downloads keep going
+                    if is_binary:
+                        await asyncio.to_thread(output_path.write_bytes, response.content)
+                    else:
+                        await asyncio.to_thread(output_path.write_text, response.text, encoding="utf-8")
+                    
+                    # Record the ETag only after the content is on disk
+                    etag = response.headers.get("etag")
+                    if etag:
+                        await asyncio.to_thread(etag_path.write_text, etag, encoding="utf-8")
+                    
+                    print(f"Downloaded {ext} format to {output_path}")
+                    return True
+                else:
+                    print(f"Failed to download {ext} format: {response.status_code}, {response.text}")
+                    return False
             except Exception as e:
                 print(f"Error downloading {ext} format: {e}")
                 print(traceback.format_exc())
+                return False
         
-        return success
+        # Download all formats concurrently over the shared client
+        downloaded = await asyncio.gather(*(_fetch(format_info) for format_info in formats))
+        
+        return any(downloaded)
 
     async def process_pdf(self, file_path):
         """
@@ -387,41 +466,43 @@ class MathpixExtractor:
         pdf_output_dir = os.path.join(self.output_dir, file_name)
         os.makedirs(pdf_output_dir, exist_ok=True)
         
-        # Check if this file has already been processed
-        relative_path = os.path.relpath(file_path, self.input_dir)
-        if relative_path in self.processed_files:
-            pdf_id = self.processed_files[relative_path]
-            print(f"PDF {file_path} was already processed with ID: {pdf_id}")
+        # Use one client for every request made for this PDF
+        async with self._create_client() as client:
+            # Check if this file has already been processed
+            relative_path = os.path.relpath(file_path, self.input_dir)
+            if relative_path in self.processed_files:
+                pdf_id = self.processed_files[relative_path]
+                print(f"PDF {file_path} was already processed with ID: {pdf_id}")
+                
+                # Check if results exist
+                if os.path.exists(os.path.join(pdf_output_dir, f"{file_name}.md")):
+                    print("Results already exist. Skipping processing.")
+                    return True
+                else:
+                    print("Results not found. Re-downloading conversion formats...")
+                    await self.download_conversion_formats(client, pdf_id, pdf_output_dir, file_name)
+                    return True
             
-            # Check if results exist
-            if os.path.exists(os.path.join(pdf_output_dir, f"{file_name}.md")):
-                print("Results already exist. Skipping processing.")
-                return True
-            else:
-                print("Results not found. Re-downloading conversion formats...")
-                await self.download_conversion_formats(pdf_id, pdf_output_dir, file_name)
-                return True
-        
-        # 1. Upload the PDF
-        pdf_id = await self.upload_pdf_file(file_path)
-        if not pdf_id:
-            return False
-        
-        # 2. Stream the results
-        results = await self.stream_pdf(pdf_id)
-        
-        # 3. Save the streamed results and extract MMD
-        success = await self.save_results(results, pdf_output_dir, file_name)
-        
-        # 4. Download additional formats after processing is complete
-        await self.download_conversion_formats(pdf_id, pdf_output_dir, file_name)
-        
-        # 5. Update the processed files map
-        if success:
-            self.processed_files[relative_path] = pdf_id
-            self._save_processed_files()
-        
-        return success
+            # 1. Upload the PDF
+            pdf_id = await self.upload_pdf_file(client, file_path)
+            if not pdf_id:
+                return False
+            
+            # 2. Stream the results
+            results = await self.stream_pdf(client, pdf_id)
+            
+            # 3. Save the streamed results and extract MMD
+            success = await self.save_results(results, pdf_output_dir, file_name)
+            
+            # 4. Download additional formats after processing is complete
+            await self.download_conversion_formats(client, pdf_id, pdf_output_dir, file_name)
+            
+            # 5. Update the processed files map
+            if success:
+                self.processed_files[relative_path] = pdf_id
+                self._save_processed_files()
+            
+            return success
 
     async def get_pdf_files(self):
         """
@@ -460,21 +541,42 @@ class MathpixExtractor:
         success_count = 0
         fail_count = 0
         skipped_count = 0
+        pending_files = []
         
         for file_path in pdf_files:
             # Check if this file has already been processed with results
+            file_name = Path(file_path).stem
             relative_path = os.path.relpath(file_path, self.input_dir)
-            pdf_output_dir = os.path.join(self.output_dir, Path(file_path).stem)
+            pdf_output_dir = os.path.join(self.output_dir, file_name)
             
-            if (relative_path in self.processed_files and 
-                os.path.exists(pdf_output_dir) and 
-                len(os.listdir(pdf_output_dir)) > 0):
+            if ((relative_path in self.processed_files and 
+                 os.path.exists(pdf_output_dir) and 
+                 len(os.listdir(pdf_output_dir)) > 0) or
+                    os.path.exists(os.path.join(pdf_output_dir, f"{file_name}_results.json"))):
                 print(f"Skipping already processed file: {file_path}")
                 skipped_count += 1
                 continue
             
-            success = await self.process_pdf(file_path)
-            if success:
+            pending_files.append(file_path)
+        
+        # Each PDF's upload, stream and download are independent, so process several at
+        # once, bounded by the semaphore to stay within the Mathpix rate limit
+        semaphore = asyncio.Semaphore(self.max_concurrent_pdfs)
+        
+        async def _process_one(file_path):
+            async with semaphore:
+                return await self.process_pdf(file_path)
+        
+        results = await asyncio.gather(
+            *(_process_one(file_path) for file_path in pending_files),
+            return_exceptions=True
+        )
+        
+        for file_path, result in zip(pending_files, results):
+            if isinstance(result, Exception):
+                print(f"Error processing {file_path}: {result}")
+                fail_count += 1
+            elif result:
                 success_count += 1
             else:
                 fail_count += 1
@@ -2,17 +2,17 @@ import os
 import json
 import re
 import asyncio
-import time
 from pathlib import Path
-import anthropic
 from anthropic.types.message_create_params import MessageCreateParamsNonStreaming
 from anthropic.types.messages.batch_create_params import Request
 from tqdm import tqdm
 import streamlit as st
+from main.extraction.claude_client import create_client
 
 
 class SubQuestionPostProcessor:
-    def __init__(self, root_dir=None, api_key=None, batch_size=20, model="claude-3-7-sonnet-20250219"):
+    def __init__(self, root_dir=None, api_key=None, batch_size=20, model="claude-3-7-sonnet-20250219",
+                 concurrency=8):
         """
         Initialize the sub-question post-processor for evaluating question independence.
         
@@ -21,14 +21,13 @@ class SubQuestionPostProcessor:
             api_key (str): API key for Anthropic
             batch_size (int): Maximum number of requests to process in a batch
             model (str): Claude model to use for processing
+            concurrency (int): Maximum number of individual requests in flight when falling back
         """
         self.root_dir = root_dir if root_dir else self._get_project_root()
         self.api_key = st.secrets["ANTHROPIC_API_KEY"]
         self.batch_size = batch_size
         self.model = model
-        
-        # Initialize the Claude client
-        self.client = anthropic.Anthropic(api_key=self.api_key)
+        self.concurrency = concurrency
         
         # Set up file paths
         self.question_bank_path = os.path.join(self.root_dir, "results_question_bank", "question_bank.json")
@@ -71,10 +70,17 @@ class SubQuestionPostProcessor:
             return []
     
     def _save_question_bank(self, question_bank):
-        """Save the updated question bank to the JSON file."""
+        """
+        Save the updated question bank to the JSON file.
+        
+        The bank is written to a temporary file first and then renamed over the
+        original, so an interrupted write never leaves a truncated question bank.
+        """
+        tmp_path = self.question_bank_path + ".tmp"
         try:
-            with open(self.question_bank_path, 'w', encoding='utf-8') as file:
+            with open(tmp_path, 'w', encoding='utf-8') as file:
                 json.dump(question_bank, file, indent=2)
+            os.replace(tmp_path, self.question_bank_path)
             return True
         except Exception as e:
             print(f"Error saving question bank: {str(e)}")
@@ -117,6 +123,26 @@ class SubQuestionPostProcessor:
             print(f"Error parsing Claude response: {str(e)}")
             return None
     
+    def _extract_text(self, message):
+        """
+        Extract the concatenated text blocks from a Claude message.
+        
+        Non-text blocks (such as thinking blocks) contribute nothing to the output.
+        
+        Args:
+            message: Claude message object (or raw content)
+            
+        Returns:
+            str: Extracted text content
+        """
+        content = getattr(message, "content", message)
+        if isinstance(content, list):
+            return "".join(
+                getattr(block, "text", "") or (block.get("text", "") if isinstance(block, dict) else "")
+                for block in content
+            )
+        return str(content)
+    
     def _extract_sub_questions(self, question_text, question_starts):
         """
         Extract complete sub-questions from the original question text.
@@ -157,11 +183,12 @@ class SubQuestionPostProcessor:
         
         return sub_questions
     
-    async def _evaluate_single_question(self, question):
+    async def _evaluate_single_question(self, client, question):
         """
         Evaluate a single question for independence (non-batch method).
         
         Args:
+            client (anthropic.AsyncAnthropic): Claude client for the current run
             question (dict): The question dictionary
             
         Returns:
@@ -179,7 +206,7 @@ class SubQuestionPostProcessor:
             prompt = self._prepare_prompt(question_text)
             
             # Send to Claude API with thinking enabled
-            message = self.client.messages.create(
+            message = await client.messages.create(
                 model=self.model,
                 max_tokens=4096,
                 temperature=1,
@@ -196,21 +223,7 @@ class SubQuestionPostProcessor:
             )
             
             # Extract text content from the response
-            if hasattr(message, 'content'):
-                if isinstance(message.content, list):
-                    # For content blocks, extract only text blocks
-                    content_text = ""
-                    for block in message.content:
-                        if hasattr(block, 'type') and block.type == 'text' and hasattr(block, 'text'):
-                            content_text += block.text
-                        elif isinstance(block, dict) and block.get('type') == 'text':
-                            content_text += block.get('text', '')
-                else:
-                    # For single content object
-                    content_text = str(message.content)
-            else:
-                # Fallback to string representation
-                content_text = str(message)
+            content_text = self._extract_text(message)
             
             # Parse the response to get the evaluation result
             result = self._parse_claude_response(content_text)
@@ -221,11 +234,60 @@ class SubQuestionPostProcessor:
             print(f"Error evaluating question {question.get('question_number')}: {str(e)}")
             return question, None
     
-    async def _process_batch(self, questions_batch):
+    async def _drain_results(self, client, batch_id, question_map):
+        """
+        Stream and parse the results of a finished batch.
+        
+        Args:
+            client (anthropic.AsyncAnthropic): Claude client for the current run
+            batch_id (str): ID of the ended batch
+            question_map (dict): Mapping of custom_id to question dictionary
+            
+        Returns:
+            list: List of tuples with (question, result)
+        """
+        results = []
+        
+        # Stream the results from the batch
+        async for result in await client.messages.batches.results(batch_id):
+            custom_id = result.custom_id
+            question = question_map.get(custom_id)
+            
+            if question is None:
+                print(f"Warning: Could not find question for custom_id {custom_id}")
+                continue
+            
+            if result.result.type == "succeeded":
+                try:
+                    # Extract text content from the message
+                    content_text = self._extract_text(result.result.message)
+                    
+                    # Parse the response
+                    evaluation_result = self._parse_claude_response(content_text)
+                    results.append((question, evaluation_result))
+                    
+                    print(f"Successfully processed question {question.get('question_number')}")
+                except Exception as e:
+                    print(f"Error parsing result for question {question.get('question_number')}: {str(e)}")
+                    results.append((question, None))
+            else:
+                # Handle error cases
+                error_type = result.result.type
+                error_message = ""
+                if error_type == "errored" and hasattr(result.result, "error"):
+                    error_message = result.result.error.message if hasattr(result.result.error, "message") else str(result.result.error)
+                
+                print(f"Failed to process question {question.get('question_number')}: {error_type} - {error_message}")
+                results.append((question, None))
+        
+        return results
+    
+    async def _process_batch(self, client, questions_batch):
         """
         Process a batch of questions using Claude's batch API.
         
         Args:
+            client (anthropic.AsyncAnthropic): Claude client for the current run
             questions_batch (list): List of question dictionaries to process
             
         Returns:
@@ -282,7 +344,7 @@ class SubQuestionPostProcessor:
             print(f"Creating batch with {len(batch_requests)} requests...")
             
             # Create the batch and get the batch ID
-            batch_response = self.client.messages.batches.create(requests=batch_requests)
+            batch_response = await client.messages.batches.create(requests=batch_requests)
             batch_id = batch_response.id
             
             print(f"Batch created with ID: {batch_id}")
@@ -294,7 +356,7 @@ class SubQuestionPostProcessor:
             
             for i in range(max_polls):
                 # Get the current batch status
-                batch_status = self.client.messages.batches.retrieve(batch_id)
+                batch_status = await client.messages.batches.retrieve(batch_id)
                 
                 print(f"Polling batch status ({i+1}/{max_polls}): {batch_status.processing_status}")
                 print(f"Counts: {batch_status.request_counts}")
@@ -312,61 +374,22 @@ class SubQuestionPostProcessor:
                 raise TimeoutError("Batch processing timed out")
             
             # Process the results
-            results = []
             print("Processing batch results...")
-            
-            # Stream the results from the batch
-            for result in self.client.messages.batches.results(batch_id):
-                custom_id = result.custom_id
-                question = question_map.get(custom_id)
-                
-                if question is None:
-                    print(f"Warning: Could not find question for custom_id {custom_id}")
-                    continue
-                
-                if result.result.type == "succeeded":
-                    try:
-                        # Extract text content from the message
-                        message = result.result.message
-                        
-                        # Extract content text based on the structure
-                        content_text = ""
-                        if hasattr(message, 'content'):
-                            if isinstance(message.content, list):
-                                for block in message.content:
-                                    if hasattr(block, 'text'):
-                                        content_text += block.text
-                            else:
-                                content_text = str(message.content)
-                        
-                        # Parse the response
-                        evaluation_result = self._parse_claude_response(content_text)
-                        results.append((question, evaluation_result))
-                        
-                        print(f"Successfully processed question {question.get('question_number')}")
-                    except Exception as e:
-                        print(f"Error parsing result for question {question.get('question_number')}: {str(e)}")
-                        results.append((question, None))
-                else:
-                    # Handle error cases
-                    error_type = result.result.type
-                    error_message = ""
-                    if error_type == "errored" and hasattr(result.result, "error"):
-                        error_message = result.result.error.message if hasattr(result.result.error, "message") else str(result.result.error)
-                    
-                    print(f"Failed to process question {question.get('question_number')}: {error_type} - {error_message}")
-                    results.append((question, None))
+            results = await self._drain_results(client, batch_id, question_map)
             
             return results
         except Exception as e:
             print(f"Error processing batch: {str(e)}")
-            # Fall back to individual processing if batch fails
+            # Fall back to individual requests if the batch fails, running them concurrently
             print("Falling back to individual processing...")
-            results = []
-            for question in questions_batch:
-                question_result = await self._evaluate_single_question(question)
-                results.append(question_result)
-            return results
+            semaphore = asyncio.Semaphore(self.concurrency)
+            
+            async def evaluate(question):
+                async with semaphore:
+                    return await self._evaluate_single_question(client, question)
+            
+            results = await asyncio.gather(*(evaluate(question) for question in questions_batch))
+            return list(results)
     
     async def run_async(self):
         """
@@ -390,76 +413,84 @@ class SubQuestionPostProcessor:
         
         print(f"Found {len(to_process)} questions with sub_questions_independent=True")
         
-        # Create a list to store questions to be deleted after processing
-        to_delete = []
-        # Create a list to store new sub-questions to be added
-        new_questions = []
+        deleted_count = 0
+        added_count = 0
         
-        # Process questions in batches
-        for i in range(0, len(to_process), self.batch_size):
-            batch = to_process[i:i + self.batch_size]
-            print(f"\nProcessing batch {i//self.batch_size + 1} of {(len(to_process) + self.batch_size - 1)//self.batch_size} ({len(batch)} questions)")
-            
-            # Process the batch
-            batch_results = await self._process_batch(batch)
-            
-            # Handle the results
-            for question, result in batch_results:
-                processed_count += 1
+        # Open the client for this run only, so its connection pool is closed before the event loop is
+        async with create_client(self.api_key) as client:
+            # Process questions in batches
+            for i in range(0, len(to_process), self.batch_size):
+                batch = to_process[i:i + self.batch_size]
+                print(f"\nProcessing batch {i//self.batch_size + 1} of {(len(to_process) + self.batch_size - 1)//self.batch_size} ({len(batch)} questions)")
                 
-                if not result:
-                    print(f"Warning: Failed to evaluate question {question.get('question_number')}. Skipping.")
-                    continue
+                # Process the batch
+                batch_results = await self._process_batch(client, batch)
                 
-                # Handle the result
-                independence = result.get("sub_questions_independent", False)
+                # Create a list to store questions to be deleted after this batch
+                to_delete = []
+                # Create a list to store new sub-questions to be added
+                new_questions = []
                 
-                if not independence:
-                    # Update the original question
-                    question["sub_questions_independent"] = False
-                    updated_count += 1
-                    print(f"Updated question {question.get('question_number')}: sub_questions_independent=False")
-                else:
-                    # Extract and create new sub-questions
-                    question_starts = result.get("question_starts", [])
-                    sub_questions = self._extract_sub_questions(question.get("question_text", ""), question_starts)
+                # Handle the results
+                for question, result in batch_results:
+                    processed_count += 1
+                    
+                    if not result:
+                        print(f"Warning: Failed to evaluate question {question.get('question_number')}. Skipping.")
+                        continue
+                    
+                    # Handle the result
+                    independence = result.get("sub_questions_independent", False)
                     
-                    if sub_questions:
-                        # Mark original question for deletion
-                        to_delete.append(question)
+                    if not independence:
+                        # Update the original question
+                        question["sub_questions_independent"] = False
+                        updated_count += 1
+                        print(f"Updated question {question.get('question_number')}: sub_questions_independent=False")
+                    else:
+                        # Extract and create new sub-questions
+                        question_starts = result.get("question_starts", [])
+                        sub_questions = self._extract_sub_questions(question.get("question_text", ""), question_starts)
                         
-                        # Create new entries for each sub-question
-                        for i, sub_q_text in enumerate(sub_questions):
-                            # Create a new question based on the original
-                            new_question = {
-                                "question_number": f"{question.get('question_number')}.{i+1}",
-                                "question_text": sub_q_text,
-                                "question_type": question.get("question_type"),
-                                "sub_questions_independent": None,  # Set to null for sub-questions
-                                "source_pdf": question.get("source_pdf"),
-                                "source_file": question.get("source_file")
-                            }
+                        if sub_questions:
+                            # Mark original question for deletion
+                            to_delete.append(question)
                             
-                            new_questions.append(new_question)
-                            extracted_count += 1
-                        
-                        print(f"Extracted {len(sub_questions)} sub-questions from question {question.get('question_number')}")
-        
-        # Remove questions marked for deletion
-        for question in to_delete:
-            if question in question_bank:
-                question_bank.remove(question)
-        
-        # Add new sub-questions
-        question_bank.extend(new_questions)
-        
-        # Save the updated question bank
-        save_success = self._save_question_bank(question_bank)
+                            # Create new entries for each sub-question
+                            for i, sub_q_text in enumerate(sub_questions):
+                                # Create a new question based on the original
+                                new_question = {
+                                    "question_number": f"{question.get('question_number')}.{i+1}",
+                                    "question_text": sub_q_text,
+                                    "question_type": question.get("question_type"),
+                                    "sub_questions_independent": None,  # Set to null for sub-questions
+                                    "source_pdf": question.get("source_pdf"),
+                                    "source_file": question.get("source_file")
+                                }
+                                
+                                new_questions.append(new_question)
+                                extracted_count += 1
+                            
+                            print(f"Extracted {len(sub_questions)} sub-questions from question {question.get('question_number')}")
+                
+                # Remove questions marked for deletion
+                for question in to_delete:
+                    if question in question_bank:
+                        question_bank.remove(question)
+                
+                # Add new sub-questions
+                question_bank.extend(new_questions)
+                
+                deleted_count += len(to_delete)
+                added_count += len(new_questions)
+                
+                # Persist after every batch so a crash only loses the batch in flight;
+                # finished questions are no longer flagged True and are skipped on restart
+                if not self._save_question_bank(question_bank):
+                    print("Failed to save updated question bank")
+                    return processed_count, updated_count, extracted_count
         
-        if save_success:
-            print(f"Successfully updated question bank: {len(to_delete)} questions deleted, {len(new_questions)} sub-questions added")
-        else:
-            print("Failed to save updated question bank")
+        print(f"Successfully updated question bank: {deleted_count} questions deleted, {added_count} sub-questions added")
         
         return processed_count, updated_count, extracted_count
     
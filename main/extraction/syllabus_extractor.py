@@ -1,6 +1,5 @@
 import os
 import asyncio
-import httpx
 import traceback
 from pathlib import Path
 from main.extraction.mathpix_extractor import MathpixExtractor
@@ -55,11 +54,12 @@ class SyllabusExtractor(MathpixExtractor):
         
         return pdf_files
     
-    async def download_md_only(self, pdf_id, output_dir, file_name):
+    async def download_md_only(self, client, pdf_id, output_dir, file_name):
         """
         Download only the MD format from Mathpix API.
         
         Args:
+            client (httpx.AsyncClient): Shared Mathpix client
             pdf_id (str): The ID of the processed PDF
             output_dir (str): Directory to save downloaded format
             file_name (str): Base name for output file
@@ -70,7 +70,7 @@ class SyllabusExtractor(MathpixExtractor):
         print(f"Waiting for processing to complete before downloading MD format...")
         
         # Wait for processing to complete
-        processing_complete = await self.wait_for_processing(pdf_id)
+        processing_complete = await self.wait_for_processing(client, pdf_id)
         if not processing_complete:
             print("Processing did not complete. MD format may not be available.")
             return False
@@ -81,24 +81,22 @@ class SyllabusExtractor(MathpixExtractor):
         os.makedirs(output_dir, exist_ok=True)
         
         url = f"{self.BASE_URL}/{pdf_id}.md"
-        headers = {"app_key": self.app_key}
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, headers=headers)
+            response = await client.get(url)
+            
+            if response.status_code == 200:
+                output_path = os.path.join(output_dir, f"{file_name}.md")
                 
-                if response.status_code == 200:
-                    output_path = os.path.join(output_dir, f"{file_name}.md")
-                    
-                    # Save the content
-                    with open(output_path, "w", encoding="utf-8") as f:
-                        f.write(response.text)
-                    
-                    print(f"Downloaded MD format to {output_path}")
-                    return True
-                else:
-                    print(f"Failed to download MD format: {response.status_code}, {response.text}")
-                    return False
+                # Save the content
+                with open(output_path, "w", encoding="utf-8") as f:
+                    f.write(response.text)
+                
+                print(f"Downloaded MD format to {output_path}")
+                return True
+            else:
+                print(f"Failed to download MD format: {response.status_code}, {response.text}")
+                return False
         except Exception as e:
             print(f"Error downloading MD format: {e}")
             import traceback
@@ -123,37 +121,39 @@ class SyllabusExtractor(MathpixExtractor):
         syllabus_output_dir = os.path.join(self.syllabus_output_dir, file_name)
         os.makedirs(syllabus_output_dir, exist_ok=True)
         
-        # Check if this file has already been processed
-        relative_path = os.path.relpath(file_path, self.input_dir)
-        syllabus_key = f"syllabus:{relative_path}"
-        
-        if syllabus_key in self.processed_files:
-            pdf_id = self.processed_files[syllabus_key]
-            print(f"Syllabus PDF {file_path} was already processed with ID: {pdf_id}")
+        # Use one client for every request made for this PDF
+        async with self._create_client() as client:
+            # Check if this file has already been processed
+            relative_path = os.path.relpath(file_path, self.input_dir)
+            syllabus_key = f"syllabus:{relative_path}"
             
-            # Check if results exist
-            if os.path.exists(os.path.join(syllabus_output_dir, f"{file_name}.md")):
-                print("Results already exist. Skipping processing.")
-                return True
-            else:
-                print("Results not found. Re-downloading MD format...")
-                await self.download_md_only(pdf_id, syllabus_output_dir, file_name)
-                return True
-        
-        # 1. Upload the PDF
-        pdf_id = await self.upload_pdf_file(file_path)
-        if not pdf_id:
-            return False
-        
-        # 2. Download only the MD format
-        success = await self.download_md_only(pdf_id, syllabus_output_dir, file_name)
-        
-        # 3. Update the processed files map
-        if success:
-            self.processed_files[syllabus_key] = pdf_id
-            self._save_processed_files()
-        
-        return success
+            if syllabus_key in self.processed_files:
+                pdf_id = self.processed_files[syllabus_key]
+                print(f"Syllabus PDF {file_path} was already processed with ID: {pdf_id}")
+                
+                # Check if results exist
+                if os.path.exists(os.path.join(syllabus_output_dir, f"{file_name}.md")):
+                    print("Results already exist. Skipping processing.")
+                    return True
+                else:
+                    print("Results not found. Re-downloading MD format...")
+                    await self.download_md_only(client, pdf_id, syllabus_output_dir, file_name)
+                    return True
+            
+            # 1. Upload the PDF
+            pdf_id = await self.upload_pdf_file(client, file_path)
+            if not pdf_id:
+                return False
+            
+            # 2. Download only the MD format
+            success = await self.download_md_only(client, pdf_id, syllabus_output_dir, file_name)
+            
+            # 3. Update the processed files map
+            if success:
+                self.processed_files[syllabus_key] = pdf_id
+                self._save_processed_files()
+            
+            return success
     
     async def run(self):
         """
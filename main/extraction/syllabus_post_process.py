@@ -1,16 +1,18 @@
 import os
-import json
-import glob
+import re
+import orjson
 import asyncio
-import time
 from pathlib import Path
-import anthropic
-from anthropic.types.message_create_params import MessageCreateParamsNonStreaming
 import streamlit as st
+from main.extraction.claude_client import create_client
+
+
+# Matches a JSON payload wrapped in a ``` or ```json code block
+_JSON_BLOCK_RE = re.compile(r'```(?:json)?\s*([\s\S]*?)\s*```')
 
 
 class SyllabusPostProcessor:
-    def __init__(self, root_dir=None, api_key=None, model="claude-3-5-haiku-20241022"):
+    def __init__(self, root_dir=None, api_key=None, model="claude-3-5-haiku-20241022", concurrency=8):
         """
         Initialize the post-processor for processing syllabus markdown files with Claude API.
         
@@ -18,13 +20,12 @@ class SyllabusPostProcessor:
             root_dir (str): The root directory of the project
             api_key (str): API key for Anthropic
             model (str): Claude model to use for processing
+            concurrency (int): Maximum number of files sent to Claude at once
         """
         self.root_dir = root_dir if root_dir else self._get_project_root()
         self.api_key = st.secrets["ANTHROPIC_API_KEY"]
         self.model = model
-        
-        # Initialize the Claude client
-        self.client = anthropic.Anthropic(api_key=self.api_key)
+        self.concurrency = concurrency
         
         # Set up directories
         self.syllabus_results_dir = os.path.join(self.root_dir, "data", "syllabus_extract_ocr")
@@ -42,17 +43,27 @@ class SyllabusPostProcessor:
         """Load the prompt template from the specified file."""
         try:
             with open(self.prompt_path, 'r', encoding='utf-8') as file:
-                return file.read()
+                template = file.read()
         except FileNotFoundError:
             print(f"Error: Prompt file not found at {self.prompt_path}")
             return None
         
+        # Split once around the placeholder so each prompt is a plain concatenation
+        self._prompt_prefix, placeholder, self._prompt_suffix = template.partition("{{syllabus_text}}")
+        if not placeholder:
+            self._prompt_suffix = None
+        
+        return template
+        
     def _prepare_prompt(self, syllabus_text):
         """Prepare the prompt by replacing the placeholder with the actual text."""
         if not self.prompt_template:
             raise ValueError("Prompt template is not loaded")
         
-        return self.prompt_template.replace("{{syllabus_text}}", syllabus_text)
+        if self._prompt_suffix is None:
+            return self.prompt_template
+        
+        return self._prompt_prefix + syllabus_text + self._prompt_suffix
     
     def _extract_text_from_content(self, content):
         """
@@ -67,6 +78,10 @@ class SyllabusPostProcessor:
         if isinstance(content, str):
             return content
         elif isinstance(content, list):
+            # Fast path for the usual single TextBlock response
+            if len(content) == 1 and hasattr(content[0], 'text'):
+                return content[0].text
+            
             # Concatenate all text blocks in the content list
             text_parts = []
             for item in content:
@@ -76,7 +91,7 @@ class SyllabusPostProcessor:
                     text_parts.append(item.get('text', ''))
                 elif isinstance(item, str):
                     text_parts.append(item)
-            return ' '.join(text_parts)
+            return ''.join(text_parts)
         else:
             # Try to extract text if it has a 'text' attribute
             if hasattr(content, 'text'):
@@ -93,34 +108,38 @@ class SyllabusPostProcessor:
         Returns:
             dict: Structured dictionary with syllabus information
         """
-        try:
-            # Try to parse the response as JSON directly
-            result = json.loads(response)
-            return result
-        except json.JSONDecodeError:
-            # If direct parsing fails, attempt to extract JSON from the response
-            # Look for a JSON structure between triple backticks or code block markers
-            import re
-            json_pattern = r'```(?:json)?\s*([\s\S]*?)\s*```'
-            match = re.search(json_pattern, response)
+        # Fast path: a response that starts like JSON is parsed directly
+        stripped = response.lstrip()
+        if stripped[:1] in ('{', '['):
+            try:
+                result = orjson.loads(stripped)
+                return result
+            except ValueError:
+                pass
+        
+        # Otherwise look for a JSON structure between triple backticks or code block markers,
+        # only running the regex when a fence is actually present
+        if response.find('```') != -1:
+            match = _JSON_BLOCK_RE.search(response)
             
             if match:
                 try:
-                    result = json.loads(match.group(1))
+                    result = orjson.loads(match.group(1))
                     return result
-                except json.JSONDecodeError:
+                except ValueError:
                     print("Error parsing JSON from code block")
-            
-            # Fallback parsing logic for non-JSON responses
-            # This can be customized based on the expected response format
-            print("Warning: Could not parse Claude's response as JSON, returning raw response")
-            return {"raw_response": response}
+        
+        # Fallback parsing logic for non-JSON responses
+        # This can be customized based on the expected response format
+        print("Warning: Could not parse Claude's response as JSON, returning raw response")
+        return {"raw_response": response}
     
-    async def _process_file(self, file_path, syllabus_name):
+    async def _process_file(self, client, file_path, syllabus_name):
         """
         Process a single markdown file with Claude API.
         
         Args:
+            client (anthropic.AsyncAnthropic): Claude client for the current run
             file_path (str): Path to the markdown file
             syllabus_name (str): Name of the syllabus folder
             
@@ -128,17 +147,12 @@ class SyllabusPostProcessor:
             tuple: (Success status, file path, result dictionary)
         """
         try:
-            # Check if the file has already been processed
+            # Derive the output path (run() has already skipped analyzed files)
             file_base_name = os.path.basename(file_path).replace('.md', '')
             output_file = os.path.join(self.syllabus_results_dir, syllabus_name, f"{file_base_name}_analyzed.json")
             
-            if os.path.exists(output_file):
-                print(f"Skipping {file_path} - analyzed JSON already exists at {output_file}")
-                return (True, file_path, None)
-            
-            # Read the content of the markdown file
-            with open(file_path, 'r', encoding='utf-8') as file:
-                syllabus_text = file.read()
+            # Read the content of the markdown file in one call, skipping the buffered text layer
+            syllabus_text = Path(file_path).read_bytes().decode('utf-8', 'replace')
             
             # Prepare the prompt
             prompt = self._prepare_prompt(syllabus_text)
@@ -146,7 +160,7 @@ class SyllabusPostProcessor:
             print(f"Processing file: {file_path}")
             
             # Send to Claude API
-            message = self.client.messages.create(
+            message = await client.messages.create(
                 model=self.model,
                 max_tokens=8192,
                 temperature=0.2,  # Lower temperature for more consistent parsing
@@ -163,8 +177,7 @@ class SyllabusPostProcessor:
             result = self._parse_claude_response(content_text)
             
             # Save the result to a JSON file
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(result, f, indent=2)
+            Path(output_file).write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2))
             
             print(f"Successfully processed: {file_path}")
             print(f"Result saved to: {output_file}")
@@ -177,7 +190,7 @@ class SyllabusPostProcessor:
     async def run(self):
         """
         Run the post-processing pipeline on all markdown files in the syllabus_extract_ocr directory,
-        processing one file at a time (no batching).
+        sending individual requests (no batching) with up to `concurrency` files in flight.
         
         Returns:
             tuple: (success count, failure count, skipped count)
@@ -191,8 +204,9 @@ class SyllabusPostProcessor:
             print(f"Syllabus results directory not found: {self.syllabus_results_dir}")
             return 0, 0, 0
         
-        syllabus_folders = [f for f in os.listdir(self.syllabus_results_dir) 
-                           if os.path.isdir(os.path.join(self.syllabus_results_dir, f))]
+        # scandir caches the entry type, so no extra stat is needed per folder
+        with os.scandir(self.syllabus_results_dir) as entries:
+            syllabus_folders = [entry.name for entry in entries if entry.is_dir(follow_symlinks=False)]
         
         if not syllabus_folders:
             print(f"No syllabus folders found in {self.syllabus_results_dir}")
@@ -200,26 +214,47 @@ class SyllabusPostProcessor:
         
         print(f"Found {len(syllabus_folders)} syllabus folders to process")
         
-        # Process each syllabus folder
+        # Collect the files to process from each syllabus folder
+        pending_files = []
         for syllabus_folder in syllabus_folders:
             folder_path = os.path.join(self.syllabus_results_dir, syllabus_folder)
-            md_files = glob.glob(os.path.join(folder_path, "*.md"))
+            
+            # Collect the markdown files and existing file names in a single directory pass
+            with os.scandir(folder_path) as entries:
+                file_names = {entry.name for entry in entries if entry.is_file()}
+            md_files = sorted(name for name in file_names if name.endswith('.md'))
             
             print(f"\nProcessing folder: {syllabus_folder}")
             print(f"Found {len(md_files)} markdown files")
             
-            # Process each file individually
-            for file_path in md_files:
-                # Process the file
-                success, _, result = await self._process_file(file_path, syllabus_folder)
+            for md_name in md_files:
+                file_path = os.path.join(folder_path, md_name)
                 
-                if result is None and success:
-                    # File was skipped because it was already processed
+                # Check if the file has already been processed
+                analyzed_name = f"{md_name.replace('.md', '')}_analyzed.json"
+                if analyzed_name in file_names:
+                    print(f"Skipping {file_path} - analyzed JSON already exists at {os.path.join(folder_path, analyzed_name)}")
                     skipped_count += 1
-                elif success:
-                    success_count += 1
-                else:
-                    failure_count += 1
+                    continue
+                
+                pending_files.append((file_path, syllabus_folder))
+        
+        # Process the files concurrently, bounded by the semaphore
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def bounded(client, file_path, syllabus_folder):
+            async with semaphore:
+                return await self._process_file(client, file_path, syllabus_folder)
+        
+        # Open the client for this run only, so its connection pool is closed before the event loop is
+        async with create_client(self.api_key) as client:
+            results = await asyncio.gather(*(bounded(client, fp, folder) for fp, folder in pending_files))
+        
+        for success, _, result in results:
+            if success:
+                success_count += 1
+            else:
+                failure_count += 1
         
         return success_count, failure_count, skipped_count
 
@@ -1,31 +1,42 @@
 import os
 import sys
 import json
+import shutil
+import functools
 from pathlib import Path
 from subquestions_post_process import SubQuestionPostProcessor
 
+# Sample question with independent sub-questions
+SAMPLE_QUESTION = {
+    "question_number": "test",
+    "question_text": "\\section{$4$ Clustering (10 pts)}\n1. [4pts] Calculate purity and Rand Index of the following two clusterings. $D_{i}$ 's are documents and $C_{i}$ 's are classes. (Purity of a clustering is an average of purity of individual clusters.) The true labels of the documents are:\n$\\left\\{\\left(D_{1}: C_{1}\\right),\\left(D_{2}: C_{2}\\right),\\left(D_{3}: C_{1}\\right),\\left(D_{4}: C_{1}\\right),\\left(D_{5}: C_{2}\\right)\\right\\}$\n\n\\section{Clustering 1:}\n\nCluster 1: $D_{1}$\nCluster 2: $D_{2}$\nCluster 3: $D_{3}$\nCluster 4: $D_{4}$\nCluster 5: $D_{5}$\n\n\\section{Clustering 2:}\n\nCluster 1: $D_{1}, D_{2}, D_{3}, D_{4}$\nCluster 2: $D_{5}$\n\nPurity:\nRand Index:\n\nPurity:\nRand Index:\n2. [2pts] Is purity a good evaluation measure by itself? In 1-2 sentences write why or why not.\n3. [4pts] Each iteration of K-means can be run using the Map-Reduce framework. Write down in 1-2 sentences what would be the (key, value) pairs in the map and the reduce step.\n\nMap step:\n\nReduce step:\n",
+    "question_type": "Mixed",
+    "sub_questions_independent": True,
+    "source_pdf": "test_pdf",
+    "source_file": "test_file.mmd"
+}
+
+
+@functools.lru_cache(maxsize=1)
+def _get_processor():
+    """
+    Create the SubQuestionPostProcessor once and reuse it, so the API client and
+    prompt template are only set up a single time per process.
+    """
+    return SubQuestionPostProcessor()
+
 
 def test_with_sample_question():
     """
     Test the SubQuestionPostProcessor with a sample question.
     This is useful for debugging and testing without modifying the actual question bank.
     """
-    # Sample question with independent sub-questions
-    sample_question = {
-        "question_number": "test",
-        "question_text": "\\section{$4$ Clustering (10 pts)}\n1. [4pts] Calculate purity and Rand Index of the following two clusterings. $D_{i}$ 's are documents and $C_{i}$ 's are classes. (Purity of a clustering is an average of purity of individual clusters.) The true labels of the documents are:\n$\\left\\{\\left(D_{1}: C_{1}\\right),\\left(D_{2}: C_{2}\\right),\\left(D_{3}: C_{1}\\right),\\left(D_{4}: C_{1}\\right),\\left(D_{5}: C_{2}\\right)\\right\\}$\n\n\\section{Clustering 1:}\n\nCluster 1: $D_{1}$\nCluster 2: $D_{2}$\nCluster 3: $D_{3}$\nCluster 4: $D_{4}$\nCluster 5: $D_{5}$\n\n\\section{Clustering 2:}\n\nCluster 1: $D_{1}, D_{2}, D_{3}, D_{4}$\nCluster 2: $D_{5}$\n\nPurity:\nRand Index:\n\nPurity:\nRand Index:\n2. [2pts] Is purity a good evaluation measure by itself? In 1-2 sentences write why or why not.\n3. [4pts] Each iteration of K-means can be run using the Map-Reduce framework. Write down in 1-2 sentences what would be the (key, value) pairs in the map and the reduce step.\n\nMap step:\n\nReduce step:\n",
-        "question_type": "Mixed",
-        "sub_questions_independent": True,
-        "source_pdf": "test_pdf",
-        "source_file": "test_file.mmd"
-    }
-    
-    # Initialize the processor
-    processor = SubQuestionPostProcessor()
+    # Reuse the shared processor
+    processor = _get_processor()
     
     # Now test the evaluation method
     print("Testing question independence evaluation...")
-    result = processor._evaluate_question_independence(sample_question["question_text"])
+    result = processor._evaluate_question_independence(SAMPLE_QUESTION["question_text"])
     
     print("\nClaude evaluation result:")
     print(json.dumps(result, indent=2))
@@ -37,7 +48,7 @@ def test_with_sample_question():
             print(f"  - {start}")
         
         # Test sub-question extraction
-        sub_questions = processor._extract_sub_questions(sample_question["question_text"], question_starts)
+        sub_questions = processor._extract_sub_questions(SAMPLE_QUESTION["question_text"], question_starts)
         print(f"\nExtracted {len(sub_questions)} complete sub-questions:")
         
         # Print each sub-question with clear boundaries
@@ -66,17 +77,12 @@ def backup_question_bank():
     backup_path = os.path.join(project_root, "results_question_bank", "question_bank_backup.json")
     
     try:
-        # Read the current question bank
-        with open(question_bank_path, 'r', encoding='utf-8') as file:
-            question_bank = json.load(file)
-        
-        # Save a backup
-        with open(backup_path, 'w', encoding='utf-8') as file:
-            json.dump(question_bank, file, indent=2)
+        # Copy the question bank byte for byte; there is no need to parse it
+        shutil.copyfile(question_bank_path, backup_path)
         
         print(f"Created backup of question bank at: {backup_path}")
         return True
-    except Exception as e:
+    except OSError as e:
         print(f"Error creating backup: {str(e)}")
         return False
 
@@ -85,7 +91,7 @@ def run_processor():
     """
     Run the SubQuestionPostProcessor on the actual question bank.
     """
-    processor = SubQuestionPostProcessor()
+    processor = _get_processor()
     processed, updated, extracted = processor.run()
     print(f"Sub-question post-processing completed: {processed} questions processed")
     print(f"  - {updated} questions had independence flag updated")
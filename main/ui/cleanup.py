@@ -5,7 +5,7 @@ Handles cleaning up processed data and files.
 
 import os
 import streamlit as st
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Define base directory and paths to clean
@@ -16,55 +16,56 @@ PATHS_TO_CLEAN = [
     BASE_DIR / "data" / "syllabus_extract_ocr" / "cs466_Syllabus",
     BASE_DIR / "data" / "sample_papers",
     BASE_DIR / "data" / "syllabus",
-    BASE_DIR / "main" / "embeddings" / "question_embeddings.pkl",
+    BASE_DIR / "main" / "embeddings" / "question_embeddings.npy",
+    BASE_DIR / "main" / "embeddings" / "question_embeddings.pkl",  # Embeddings saved by older versions
     BASE_DIR / "main" / "embeddings" / "question_metadata.json",
     BASE_DIR / "results_question_bank"
 ]
 
-def clean_directory(directory_path):
+def _fast_rmtree(path):
     """
-    Remove all files and subdirectories from the specified directory.
+    Recursively delete a directory tree using os.scandir.
+    
+    The DirEntry type information comes from the directory listing itself, so no
+    extra stat call is needed per entry.
     
     Args:
-        directory_path (Path): Directory to clean
-        
-    Returns:
-        bool: True if successful, False otherwise
+        path (Path): Directory to delete
     """
-    try:
-        if not directory_path.exists():
-            return True
-            
-        if directory_path.is_file():
-            directory_path.unlink()
-        else:
-            # Remove all contents of the directory
-            shutil.rmtree(directory_path)
-            # Recreate the directory
-            directory_path.mkdir(parents=True, exist_ok=True)
-            
-        return True
-    except Exception as e:
-        st.error(f"Error cleaning {directory_path}: {str(e)}")
-        return False
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                _fast_rmtree(Path(entry.path))
+            else:
+                os.unlink(entry.path)
+    os.rmdir(path)
 
-def clean_file(file_path):
+def _clean_path(path):
     """
-    Remove a specific file.
+    Remove a file, or all files and subdirectories of a directory, without reporting
+    to Streamlit so that it can run in a worker thread.
     
     Args:
-        file_path (Path): File to remove
+        path (Path): File or directory to clean
         
     Returns:
-        bool: True if successful, False otherwise
+        tuple: (True if something was removed, error message or None)
     """
     try:
-        if file_path.exists():
-            file_path.unlink()
-        return True
+        if not path.exists():
+            return False, None
+            
+        if path.is_file():
+            path.unlink()
+        else:
+            # Remove all contents of the directory
+            _fast_rmtree(path)
+            # Recreate the directory
+            path.mkdir(parents=True, exist_ok=True)
+            
+        return True, None
     except Exception as e:
-        st.error(f"Error removing {file_path}: {str(e)}")
-        return False
+        return False, f"Error cleaning {path}: {str(e)}"
 
 def clean_all_data():
     """
@@ -76,18 +77,17 @@ def clean_all_data():
     success_count = 0
     failure_count = 0
     
-    for path in PATHS_TO_CLEAN:
-        if path.exists():
-            if path.is_file():
-                if clean_file(path):
-                    success_count += 1
-                else:
-                    failure_count += 1
-            else:
-                if clean_directory(path):
-                    success_count += 1
-                else:
-                    failure_count += 1
+    # Clean the paths in parallel; errors are reported afterwards on this thread
+    # because Streamlit calls are not safe from worker threads
+    with ThreadPoolExecutor(max_workers=len(PATHS_TO_CLEAN)) as executor:
+        results = list(executor.map(_clean_path, PATHS_TO_CLEAN))
+    
+    for cleaned, error in results:
+        if error:
+            st.error(error)
+            failure_count += 1
+        elif cleaned:
+            success_count += 1
     
     if failure_count == 0:
         return {
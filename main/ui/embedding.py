@@ -8,6 +8,7 @@ import streamlit as st
 import sys
 from pathlib import Path
 import json
+import torch
 
 # Add project root to path for imports
 current_file = Path(__file__)
@@ -20,7 +21,7 @@ from main.embeddings.question_embedding_generator import QuestionEmbeddingGenera
 # Define paths
 QUESTION_BANK_PATH = BASE_DIR / "results_question_bank" / "question_bank.json"
 EMBEDDINGS_DIR = BASE_DIR / "main" / "embeddings"
-EMBEDDING_PATH = EMBEDDINGS_DIR / "question_embeddings.pkl"
+EMBEDDING_PATH = EMBEDDINGS_DIR / "question_embeddings.npy"
 METADATA_PATH = EMBEDDINGS_DIR / "question_metadata.json"
 
 @st.cache_resource
@@ -34,11 +35,19 @@ def get_embedding_generator():
     # Create output directory if it doesn't exist
     EMBEDDINGS_DIR.mkdir(parents=True, exist_ok=True)
     
+    # Use the GPU when available; otherwise let torch use every CPU core
+    if torch.cuda.is_available():
+        device = "cuda"
+    else:
+        device = "cpu"
+        torch.set_num_threads(os.cpu_count() or 1)
+    
     # Initialize the generator
     generator = QuestionEmbeddingGenerator(
         model_name="all-MiniLM-L6-v2",
         embedding_path=str(EMBEDDING_PATH),
-        metadata_path=str(METADATA_PATH)
+        metadata_path=str(METADATA_PATH),
+        device=device
     )
     
     return generator
@@ -67,7 +76,9 @@ def generate_embeddings(force_regenerate=False, auto_tag=True):
         # Generate embeddings
         embeddings, metadata = generator.process_question_bank(
             str(QUESTION_BANK_PATH), 
-            force_regenerate=force_regenerate
+            force_regenerate=force_regenerate,
+            batch_size=128,
+            show_progress_bar=False
         )
         
         result = {
@@ -96,13 +107,14 @@ def generate_embeddings(force_regenerate=False, auto_tag=True):
             "message": f"Error generating embeddings: {str(e)}"
         }
 
-def search_similar_questions(query, top_k=5):
+def search_similar_questions(query, top_k=5, filter_fn=None):
     """
     Search for questions similar to the query.
     
     Args:
         query (str): Query text
         top_k (int): Number of results to return
+        filter_fn (callable): Optional predicate on question metadata; only matching questions are ranked
         
     Returns:
         list or None: Search results if successful, None otherwise
@@ -119,7 +131,7 @@ def search_similar_questions(query, top_k=5):
             generator.load()
         
         # Search for similar questions
-        results = generator.search_similar_questions(query, top_k=top_k)
+        results = generator.search_similar_questions(query, top_k=top_k, filter_fn=filter_fn)
         
         return results
     except Exception as e:
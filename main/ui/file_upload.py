@@ -6,6 +6,7 @@ Handles file uploads for question papers and syllabus.
 import os
 import streamlit as st
 import shutil
+from functools import lru_cache
 from pathlib import Path
 
 # Base paths
@@ -14,11 +15,92 @@ BASE_DIR = current_file.parent.parent.parent
 SAMPLE_PAPERS_DIR = BASE_DIR / "data" / "sample_papers"
 SYLLABUS_DIR = BASE_DIR / "data" / "syllabus"
 
+def _scandir_files(path, suffix):
+    """
+    List the files in a directory whose names end with the given suffix.
+    
+    Uses os.scandir so the file type of each entry comes from the directory listing
+    instead of an extra stat call per entry.
+    
+    Args:
+        path (Path): Directory to list
+        suffix (str): File name suffix to match
+        
+    Returns:
+        list: Paths of the matching files
+    """
+    try:
+        with os.scandir(path) as entries:
+            return [
+                entry.path for entry in entries
+                if entry.name.endswith(suffix) and entry.is_file(follow_symlinks=False)
+            ]
+    except FileNotFoundError:
+        return []
+
+@lru_cache(maxsize=8)
+def _cached_listing(dir_str, suffix, mtime_ns):
+    """
+    Cached directory listing, keyed on the directory's modification time.
+    
+    Adding or removing a file bumps the directory mtime, so a changed directory is
+    listed again while Streamlit reruns of an unchanged one are served from the cache.
+    
+    Args:
+        dir_str (str): Directory to list
+        suffix (str): File name suffix to match
+        mtime_ns (int): Modification time of the directory in nanoseconds
+        
+    Returns:
+        tuple: Paths of the matching files
+    """
+    return tuple(_scandir_files(dir_str, suffix))
+
+def _list_files(path, suffix):
+    """
+    List the files in a directory with the given suffix, reusing the cached listing
+    while the directory is unchanged.
+    
+    Args:
+        path (Path): Directory to list
+        suffix (str): File name suffix to match
+        
+    Returns:
+        tuple: Paths of the matching files
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return ()
+    return _cached_listing(str(path), suffix, mtime_ns)
+
 def ensure_directories():
     """Ensure all necessary directories exist."""
     SAMPLE_PAPERS_DIR.mkdir(parents=True, exist_ok=True)
     SYLLABUS_DIR.mkdir(parents=True, exist_ok=True)
 
+def _save_upload(uploaded_file, file_path):
+    """
+    Write an uploaded file to disk.
+    
+    The file is streamed in 1 MiB chunks to a partial file that is renamed over the
+    target once complete, so a failed upload never leaves a truncated PDF. The partial
+    file is removed if the write fails.
+    
+    Args:
+        uploaded_file (UploadedFile): File from st.file_uploader
+        file_path (Path): Destination path
+    """
+    uploaded_file.seek(0)
+    tmp_path = file_path.with_name(file_path.name + ".part")
+    try:
+        with open(tmp_path, "wb", buffering=1 << 20) as f:
+            shutil.copyfileobj(uploaded_file, f, length=1 << 20)
+        os.replace(tmp_path, file_path)
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
 def upload_question_papers():
     """
     Handle upload of question paper PDFs.
@@ -49,12 +131,17 @@ def upload_question_papers():
                     st.info(f"Skipping {uploaded_file.name}")
                     continue
             
-            # Save the file
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            try:
+                _save_upload(uploaded_file, file_path)
+            except Exception as e:
+                st.error(f"Error saving {uploaded_file.name}: {str(e)}")
+                continue
             
             st.success(f"Saved {uploaded_file.name}")
             uploaded_paths.append(str(file_path))
+        
+        # Refresh the cached listings after writing new files
+        _cached_listing.cache_clear()
     
     return uploaded_paths
 
@@ -84,9 +171,14 @@ def upload_syllabus():
                 st.info(f"Skipping {uploaded_file.name}")
                 return None
         
-        # Save the file
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
+        try:
+            _save_upload(uploaded_file, file_path)
+        except Exception as e:
+            st.error(f"Error saving {uploaded_file.name}: {str(e)}")
+            return None
+        
+        # Refresh the cached listings after writing the new file
+        _cached_listing.cache_clear()
         
         st.success(f"Saved {uploaded_file.name}")
         return str(file_path)
@@ -101,12 +193,12 @@ def check_files_exist():
         tuple: (bool, str) indicating if files exist and a message
     """
     # Check for question papers
-    question_papers = list(SAMPLE_PAPERS_DIR.glob("*.pdf"))
+    question_papers = _list_files(SAMPLE_PAPERS_DIR, ".pdf")
     if not question_papers:
         return False, "No question papers found. Please upload at least one question paper."
     
     # Check for syllabus
-    syllabus_files = list(SYLLABUS_DIR.glob("*.pdf"))
+    syllabus_files = _list_files(SYLLABUS_DIR, ".pdf")
     if not syllabus_files:
         return False, "No syllabus found. Please upload a syllabus."
     
@@ -0,0 +1,49 @@
+"""
+File utilities for DocuMagnetIR Streamlit application.
+Shared helpers for finding and reading the JSON results used across the UI modules.
+"""
+
+import os
+import streamlit as st
+import orjson
+from pathlib import Path
+
+
+def iter_analyzed_files(path):
+    """
+    Lazily find the *_analyzed.json files one folder below a directory.
+    
+    Uses os.scandir so the file type of each entry comes from the directory listing,
+    and stops scanning as soon as the caller stops iterating.
+    
+    Args:
+        path (Path): Directory containing one folder per syllabus
+        
+    Yields:
+        str: Path of an analyzed syllabus file
+    """
+    try:
+        with os.scandir(path) as folders:
+            for folder in folders:
+                if not folder.is_dir():
+                    continue
+                with os.scandir(folder.path) as entries:
+                    for entry in entries:
+                        if entry.name.endswith("_analyzed.json") and entry.is_file(follow_symlinks=False):
+                            yield entry.path
+    except FileNotFoundError:
+        return
+
+@st.cache_data
+def load_json(path_str, mtime_ns):
+    """
+    Parse a JSON file, keeping the result cached until the file is modified.
+    
+    Args:
+        path_str (str): Path to the JSON file
+        mtime_ns (int): Modification time of the file in nanoseconds, used as the cache key
+        
+    Returns:
+        dict or list: Parsed JSON data
+    """
+    return orjson.loads(Path(path_str).read_bytes())
\ No newline at end of file
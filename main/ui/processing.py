@@ -15,18 +15,17 @@ current_file = Path(__file__)
 BASE_DIR = current_file.parent.parent.parent
 sys.path.append(str(BASE_DIR))
 
-# Import processing functions
-# These will be imported when the module is used
-from main.extraction.main_questions_extraction import process_documents
-from main.extraction.main_syllabus_extraction import process_syllabus_documents
+from main.ui.file_utils import load_json, iter_analyzed_files
 
+# Processing functions are imported inside the run_* functions, so the heavy extraction
+# stack is only loaded when a pipeline is actually run
 
 # Define paths
 OCR_RESULTS_DIR = BASE_DIR / "data" / "ocr_results"
 QUESTION_BANK_PATH = BASE_DIR / "results_question_bank" / "question_bank.json"
 SYLLABUS_RESULTS_DIR = BASE_DIR / "data" / "syllabus_extract_ocr"
 
-@st.cache_data
+@st.cache_resource
 def run_document_processing():
     """
     Run the document processing pipeline.
@@ -35,13 +34,10 @@ def run_document_processing():
         dict: Processing results with success status and message
     """
     try:
-        # Create an asyncio event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        from main.extraction.main_questions_extraction import process_documents
         
-        # Run the document processing function
-        result = loop.run_until_complete(process_documents())
-        loop.close()
+        # Run the document processing function on a fresh event loop that is shut down afterwards
+        result = asyncio.run(process_documents())
         
         # Check if question bank was generated
         if QUESTION_BANK_PATH.exists():
@@ -64,7 +60,7 @@ def run_document_processing():
             "message": f"Error in document processing: {str(e)}"
         }
 
-@st.cache_data
+@st.cache_resource
 def run_syllabus_processing():
     """
     Run the syllabus processing pipeline.
@@ -73,13 +69,10 @@ def run_syllabus_processing():
         dict: Processing results with success status and message
     """
     try:
-        # Create an asyncio event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        from main.extraction.main_syllabus_extraction import process_syllabus_documents
         
-        # Run the syllabus processing function
-        result = loop.run_until_complete(process_syllabus_documents())
-        loop.close()
+        # Run the syllabus processing function on a fresh event loop that is shut down afterwards
+        result = asyncio.run(process_syllabus_documents())
         
         # Check if syllabus was processed
         syllabus_folders = list(SYLLABUS_RESULTS_DIR.glob("*"))
@@ -107,8 +100,7 @@ def get_question_data():
         dict or None: Question bank data if available
     """
     if QUESTION_BANK_PATH.exists():
-        with open(QUESTION_BANK_PATH, 'r') as f:
-            return json.load(f)
+        return load_json(str(QUESTION_BANK_PATH), QUESTION_BANK_PATH.stat().st_mtime_ns)
     return None
 
 def get_syllabus_data():
@@ -118,10 +110,9 @@ def get_syllabus_data():
     Returns:
         dict or None: Syllabus data if available
     """
-    analyzed_files = list(SYLLABUS_RESULTS_DIR.glob("*/*_analyzed.json"))
-    if analyzed_files:
-        with open(analyzed_files[0], 'r') as f:
-            return json.load(f)
+    analyzed_file = next(iter_analyzed_files(SYLLABUS_RESULTS_DIR), None)
+    if analyzed_file:
+        return load_json(analyzed_file, os.stat(analyzed_file).st_mtime_ns)
     return None
 
 def check_processing_completed():
@@ -131,7 +122,7 @@ def check_processing_completed():
     Returns:
         bool: True if both have been completed, False otherwise
     """
-    question_data = get_question_data()
-    syllabus_data = get_syllabus_data()
-    
-    return question_data is not None and syllabus_data is not None
\ No newline at end of file
+    # Only the presence of the outputs matters here, so avoid parsing the JSON files
+    # on every Streamlit rerun and stop at the first analyzed syllabus found
+    return (QUESTION_BANK_PATH.is_file() and 
+            next(iter_analyzed_files(SYLLABUS_RESULTS_DIR), None) is not None)
\ No newline at end of file
@@ -15,7 +15,15 @@ BASE_DIR = current_file.parent.parent.parent
 sys.path.append(str(BASE_DIR))
 
 # Import from embedding module
-from main.ui.embedding import search_similar_questions, check_embeddings_exist
+from main.ui.embedding import search_similar_questions, check_embeddings_exist, METADATA_PATH
+
+# Result fields shown for each search hit, with the value used when a field is missing
+_RESULT_FIELDS = (
+    ('similarity_score', 0), 
+    ('question_number', 'Unknown'), 
+    ('question_type', 'Unknown'), 
+    ('source_file', 'Unknown')
+)
 
 def create_query_interface():
     """
@@ -60,10 +68,9 @@ def display_search_results(query, results):
     st.subheader(f"Search Results for: '{query}'")
     
     for i, result in enumerate(results, 1):
-        similarity_score = result.get('similarity_score', 0)
-        question_number = result.get('question_number', 'Unknown')
-        question_type = result.get('question_type', 'Unknown')
-        source_file = result.get('source_file', 'Unknown')
+        similarity_score, question_number, question_type, source_file = [
+            result.get(field, default) for field, default in _RESULT_FIELDS
+        ]
         
         # Get the question text
         original_object = result.get('original_object', {})
@@ -71,8 +78,9 @@ def display_search_results(query, results):
         
         # Get topic information if available
         tags = result.get('tags', [])
-        main_topic = tags[0].get('main_topic', 'Unknown') if tags else 'Unknown'
-        subtopic = tags[0].get('subtopic', 'Unknown') if tags else 'Unknown'
+        first_tag = tags[0] if tags else {}
+        main_topic = first_tag.get('main_topic', 'Unknown')
+        subtopic = first_tag.get('subtopic', 'Unknown')
         
         # Show the result
         with st.expander(f"#{i}: Question {question_number} (Score: {similarity_score:.4f})"):
@@ -98,6 +106,62 @@ def display_search_results(query, results):
             st.markdown("**Question Text:**")
             st.markdown(question_text)
 
+@st.cache_resource(max_entries=1)
+def _metadata_frame(metadata_mtime, _metadata):
+    """
+    Build a DataFrame of the filterable metadata columns, cached until the metadata file is rewritten.
+    
+    Row labels are positions in the metadata list, so filtered rows map straight back
+    to the original metadata dictionaries.
+    
+    Args:
+        metadata_mtime (int): Modification time of the metadata file in nanoseconds, used as the cache key
+        _metadata (list): Question metadata from the embedding generator (not hashed)
+        
+    Returns:
+        pandas.DataFrame: question_type and source_file of every question
+    """
+    return pd.DataFrame({
+        'question_type': [item.get('question_type') for item in _metadata],
+        'source_file': [item.get('source_file') for item in _metadata]
+    })
+
+@st.cache_data
+def _extract_filter_options(metadata_mtime, _metadata_df):
+    """
+    Derive the sorted filter choices, cached until the metadata file is rewritten.
+    
+    Args:
+        metadata_mtime (int): Modification time of the metadata file in nanoseconds, used as the cache key
+        _metadata_df (pandas.DataFrame): Frame returned by _metadata_frame (not hashed)
+        
+    Returns:
+        tuple: (question types, source files) as sorted tuples
+    """
+    question_types = tuple(sorted(_metadata_df['question_type'].dropna().unique()))
+    source_files = tuple(sorted(_metadata_df['source_file'].dropna().unique()))
+    return question_types, source_files
+
+def _make_filter(selected_type, selected_source):
+    """
+    Build a metadata predicate for the selected question type and source file.
+    
+    Args:
+        selected_type (str): Selected question type, or "Any"
+        selected_source (str): Selected source file, or "Any"
+        
+    Returns:
+        callable or None: Predicate on question metadata, or None when nothing is filtered
+    """
+    if selected_type == "Any" and selected_source == "Any":
+        return None
+    
+    def filter_fn(item):
+        return ((selected_type == "Any" or item.get('question_type') == selected_type) and
+                (selected_source == "Any" or item.get('source_file') == selected_source))
+    
+    return filter_fn
+
 def create_filtered_search():
     """
     Create an interface for filtered search based on metadata.
@@ -123,25 +187,16 @@ def create_filtered_search():
             return
     
     # Extract metadata for filtering
-    question_types = set()
-    source_files = set()
-    
-    for item in generator.metadata:
-        if 'question_type' in item:
-            question_types.add(item['question_type'])
-        if 'source_file' in item:
-            source_files.add(item['source_file'])
-    
-    # Convert to sorted lists
-    question_types = sorted(list(question_types))
-    source_files = sorted(list(source_files))
+    metadata_mtime = METADATA_PATH.stat().st_mtime_ns
+    metadata_df = _metadata_frame(metadata_mtime, generator.metadata)
+    question_types, source_files = _extract_filter_options(metadata_mtime, metadata_df)
     
     # Create filters
     col1, col2 = st.columns(2)
     with col1:
-        selected_type = st.selectbox("Filter by Question Type:", ["Any"] + question_types)
+        selected_type = st.selectbox("Filter by Question Type:", ["Any", *question_types])
     with col2:
-        selected_source = st.selectbox("Filter by Source File:", ["Any"] + source_files)
+        selected_source = st.selectbox("Filter by Source File:", ["Any", *source_files])
     
     # Query input
     query = st.text_input("Enter your search query (optional):", key="filtered_query")
@@ -154,47 +209,28 @@ def create_filtered_search():
     search_button = st.button("Search", key="filtered_search_button")
     
     if search_button:
-        # Filter the metadata based on selection
-        filtered_results = []
-        
-        for item in generator.metadata:
-            # Apply type filter
-            if selected_type != "Any" and item.get('question_type') != selected_type:
-                continue
-                
-            # Apply source filter
-            if selected_source != "Any" and item.get('source_file') != selected_source:
-                continue
-            
-            # Add to filtered results
-            filtered_results.append(item)
-        
         # Apply text search if query is provided
         if query:
             with st.spinner("Searching..."):
-                # Search within filtered results
-                search_results = search_similar_questions(query, top_k=top_k)
+                # Apply the metadata filters inside the search so up to top_k matches are ranked
+                filter_fn = _make_filter(selected_type, selected_source)
+                search_results = search_similar_questions(query, top_k=top_k, filter_fn=filter_fn)
                 
                 if search_results:
-                    # Filter search results by the metadata filters
-                    final_results = []
-                    for result in search_results:
-                        # Apply type filter
-                        if selected_type != "Any" and result.get('question_type') != selected_type:
-                            continue
-                            
-                        # Apply source filter
-                        if selected_source != "Any" and result.get('source_file') != selected_source:
-                            continue
-                        
-                        final_results.append(result)
-                    
-                    display_search_results(query, final_results)
+                    display_search_results(query, search_results)
                 else:
                     st.error("No results found matching your criteria.")
         else:
+            # Filter the metadata based on selection with vectorized column comparisons
+            mask = pd.Series(True, index=metadata_df.index)
+            if selected_type != "Any":
+                mask &= metadata_df['question_type'] == selected_type
+            if selected_source != "Any":
+                mask &= metadata_df['source_file'] == selected_source
+            
             # Just show filtered results by metadata
-            display_filtered_results(filtered_results[:top_k])
+            filtered_results = [generator.metadata[idx] for idx in metadata_df.index[mask][:top_k]]
+            display_filtered_results(filtered_results)
 
 def display_filtered_results(results):
     """
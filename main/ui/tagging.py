@@ -7,7 +7,7 @@ import os
 import streamlit as st
 import sys
 from pathlib import Path
-import json
+from itertools import chain
 
 # Add project root to path for imports
 current_file = Path(__file__)
@@ -16,10 +16,11 @@ sys.path.append(str(BASE_DIR))
 
 # Import question tagger
 from main.embeddings.question_tagger import QuestionTopicTagger
+from main.ui.file_utils import load_json, iter_analyzed_files
 
 # Define paths
 EMBEDDINGS_DIR = BASE_DIR / "main" / "embeddings"
-EMBEDDING_PATH = EMBEDDINGS_DIR / "question_embeddings.pkl"
+EMBEDDING_PATH = EMBEDDINGS_DIR / "question_embeddings.npy"
 METADATA_PATH = EMBEDDINGS_DIR / "question_metadata.json"
 SYLLABUS_DIR = BASE_DIR / "data" / "syllabus_extract_ocr"
 TAGGED_QUESTIONS_PATH = BASE_DIR / "results_question_bank" / "tagged_questions.json"
@@ -37,7 +38,7 @@ def get_question_tagger():
         return None
     
     # Find the syllabus file
-    syllabus_files = list(SYLLABUS_DIR.glob("*/*_analyzed.json"))
+    syllabus_files = list(iter_analyzed_files(SYLLABUS_DIR))
     if not syllabus_files:
         return None
     
@@ -68,7 +69,7 @@ def generate_tags():
         }
     
     # Find analyzed syllabus files
-    syllabus_files = list(SYLLABUS_DIR.glob("*/*_analyzed.json"))
+    syllabus_files = list(iter_analyzed_files(SYLLABUS_DIR))
     if not syllabus_files:
         return {
             "success": False,
@@ -89,11 +90,10 @@ def generate_tags():
         
         # Calculate statistics
         topic_count = len(organized_data["topics"])
-        question_count = sum(
-            len(question_list["questions"]) 
-            for topic in organized_data["topics"] 
-            for question_list in topic["subtopics"]
-        )
+        question_count = sum(map(len, (
+            question_list["questions"] 
+            for question_list in chain.from_iterable(topic["subtopics"] for topic in organized_data["topics"])
+        )))
         
         return {
             "success": True,
@@ -124,6 +124,5 @@ def load_tagged_questions():
         dict or None: Tagged questions data if file exists, None otherwise
     """
     if TAGGED_QUESTIONS_PATH.exists():
-        with open(TAGGED_QUESTIONS_PATH, 'r') as f:
-            return json.load(f)
+        return load_json(str(TAGGED_QUESTIONS_PATH), TAGGED_QUESTIONS_PATH.stat().st_mtime_ns)
     return None
\ No newline at end of file
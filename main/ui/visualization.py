@@ -5,19 +5,22 @@ Handles displaying statistics and charts for processed questions.
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
-from collections import Counter
-import json
+from plotly.colors import qualitative
 from pathlib import Path
+import sys
 
-# Define paths
+# Add project root to path for imports
 current_file = Path(__file__)
 BASE_DIR = current_file.parent.parent.parent
+sys.path.append(str(BASE_DIR))
+
+from main.ui.file_utils import load_json
+
+# Define paths
 QUESTION_BANK_PATH = BASE_DIR / "results_question_bank" / "question_bank.json"
 TAGGED_QUESTIONS_PATH = BASE_DIR / "results_question_bank" / "tagged_questions.json"
 
-@st.cache_data
 def load_question_data():
     """
     Load the question bank data.
@@ -26,11 +29,9 @@ def load_question_data():
         list or None: List of questions if file exists, None otherwise
     """
     if QUESTION_BANK_PATH.exists():
-        with open(QUESTION_BANK_PATH, 'r') as f:
-            return json.load(f)
+        return load_json(str(QUESTION_BANK_PATH), QUESTION_BANK_PATH.stat().st_mtime_ns)
     return None
 
-@st.cache_data
 def load_tagged_questions():
     """
     Load the tagged questions data.
@@ -39,47 +40,206 @@ def load_tagged_questions():
         dict or None: Tagged questions data if file exists, None otherwise
     """
     if TAGGED_QUESTIONS_PATH.exists():
-        with open(TAGGED_QUESTIONS_PATH, 'r') as f:
-            return json.load(f)
+        return load_json(str(TAGGED_QUESTIONS_PATH), TAGGED_QUESTIONS_PATH.stat().st_mtime_ns)
     return None
 
-def display_question_type_distribution(questions):
+def _data_key(path, data):
     """
-    Display a pie chart of question types.
+    Build a cheap cache key for data loaded from a file, instead of hashing the data itself.
     
     Args:
-        questions (list): List of question objects
+        path (Path): File the data was loaded from
+        data (list or dict): The loaded data
+        
+    Returns:
+        tuple: (file modification time in nanoseconds or None, number of items)
     """
-    if not questions:
-        st.warning("No question data available")
-        return
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime_ns = None
+    return mtime_ns, len(data)
+
+@st.cache_data
+def _count_frame(field, label, data_key, _questions):
+    """
+    Count the values of a question field, cached until the question bank changes.
     
-    # Count question types
-    question_types = [q.get('question_type', 'Unknown') for q in questions]
-    type_counts = Counter(question_types)
-    
-    # Create a DataFrame for the plot
-    df = pd.DataFrame({
-        'Question Type': list(type_counts.keys()),
-        'Count': list(type_counts.values())
-    })
-    
-    # Create a pie chart
-    fig = px.pie(
-        df, 
-        names='Question Type', 
-        values='Count',
-        title='Question Type Distribution',
-        color_discrete_sequence=px.colors.qualitative.Pastel
+    Args:
+        field (str): Question field to count
+        label (str): Column name for the counted values
+        data_key (tuple): Key from _data_key for the question bank
+        _questions (list): List of question objects (not hashed)
+        
+    Returns:
+        pandas.DataFrame: Values and their counts, sorted by count
+    """
+    counts = pd.Series([q.get(field, 'Unknown') for q in _questions]).value_counts(dropna=False)
+    return counts.rename_axis(label).reset_index(name='Count')
+
+@st.cache_data
+def _topic_frames(data_key, _tagged_data):
+    """
+    Count the questions per topic and subtopic, cached until the tagged data changes.
+    
+    Args:
+        data_key (tuple): Key from _data_key for the tagged questions
+        _tagged_data (dict): Tagged questions data (not hashed)
+        
+    Returns:
+        tuple: (topic counts dict, subtopic DataFrames by topic, topic counts DataFrame)
+    """
+    # Flatten the topic tree in one pass into tidy (topic, subtopic, count) rows
+    topic_names = [topic['name'] for topic in _tagged_data['topics']]
+    tidy = pd.DataFrame(
+        [
+            (topic['name'], subtopic['name'], len(subtopic['questions']))
+            for topic in _tagged_data['topics'] 
+            for subtopic in topic['subtopics']
+        ],
+        columns=['Topic', 'Subtopic', 'Question Count']
     )
     
+    # Derive the topic totals with a vectorized groupby, keeping topics without subtopics
+    totals = tidy.groupby('Topic', sort=False)['Question Count'].sum()
+    totals = totals.reindex(pd.Index(topic_names).unique(), fill_value=0)
+    topic_counts = totals.to_dict()
+    
+    # Store subtopic details
+    subtopic_details = {
+        topic_name: group.drop(columns='Topic').sort_values('Question Count', ascending=False)
+        for topic_name, group in tidy.groupby('Topic', sort=False)
+    }
+    for topic_name in topic_counts:
+        subtopic_details.setdefault(topic_name, tidy.iloc[0:0].drop(columns='Topic'))
+    
+    # Create a DataFrame for topic counts
+    topics_df = totals.rename_axis('Topic').reset_index(name='Question Count').sort_values(
+        'Question Count', ascending=False
+    )
+    
+    return topic_counts, subtopic_details, topics_df
+
+def _pastel_colors(n):
+    """
+    Give each of n bars its own color from the pastel palette, cycling when needed.
+    
+    Args:
+        n (int): Number of bars
+        
+    Returns:
+        list: Color for each bar
+    """
+    palette = qualitative.Pastel
+    return [palette[i % len(palette)] for i in range(n)]
+
+@st.cache_resource
+def _type_pie_chart(data_key, _df):
+    """
+    Build the question type pie chart.
+    
+    Figures are cached by reference, so Streamlit reruns skip rebuilding the plotly traces.
+    
+    Args:
+        data_key (tuple): Key from _data_key for the data behind the chart
+        _df (pandas.DataFrame): Counts to plot (not hashed)
+        
+    Returns:
+        plotly.graph_objects.Figure: The chart
+    """
+    # Create a pie chart straight from the counts
+    fig = go.Figure(go.Pie(
+        labels=_df['Question Type'].to_numpy(), 
+        values=_df['Count'].to_numpy(),
+        marker=dict(colors=qualitative.Pastel),
+        textposition='inside', 
+        textinfo='percent+label'
+    ))
+    
     # Update layout for better appearance
-    fig.update_traces(textposition='inside', textinfo='percent+label')
     fig.update_layout(
+        title='Question Type Distribution',
         autosize=True,
         margin=dict(l=20, r=20, t=30, b=20),
     )
     
+    return fig
+
+@st.cache_resource
+def _topic_bar_chart(data_key, _topics_df):
+    """
+    Build the questions-by-topic bar chart.
+    
+    Args:
+        data_key (tuple): Key from _data_key for the data behind the chart
+        _topics_df (pandas.DataFrame): Counts to plot (not hashed)
+        
+    Returns:
+        plotly.graph_objects.Figure: The chart
+    """
+    fig = go.Figure(go.Bar(
+        x=_topics_df['Topic'].to_numpy(), 
+        y=_topics_df['Question Count'].to_numpy(),
+        marker_color=_pastel_colors(len(_topics_df))
+    ))
+    
+    fig.update_layout(
+        title='Questions by Topic',
+        xaxis_title="Topic",
+        yaxis_title="Number of Questions",
+        autosize=True,
+        margin=dict(l=20, r=20, t=40, b=20),
+    )
+    
+    return fig
+
+@st.cache_resource
+def _source_bar_chart(data_key, _df):
+    """
+    Build the questions-by-source bar chart.
+    
+    Args:
+        data_key (tuple): Key from _data_key for the data behind the chart
+        _df (pandas.DataFrame): Counts to plot (not hashed)
+        
+    Returns:
+        plotly.graph_objects.Figure: The chart
+    """
+    # Create a bar chart straight from the counts
+    fig = go.Figure(go.Bar(
+        x=_df['Source File'].to_numpy(), 
+        y=_df['Count'].to_numpy(),
+        marker_color=_pastel_colors(len(_df))
+    ))
+    
+    fig.update_layout(
+        title='Questions by Source File',
+        xaxis_title="Source File",
+        yaxis_title="Number of Questions",
+        autosize=True,
+        margin=dict(l=20, r=20, t=40, b=20),
+    )
+    
+    return fig
+
+def display_question_type_distribution(questions):
+    """
+    Display a pie chart of question types.
+    
+    Args:
+        questions (list): List of question objects
+    """
+    if not questions:
+        st.warning("No question data available")
+        return
+    
+    # Count question types, reusing the counts while the question bank is unchanged
+    data_key = _data_key(QUESTION_BANK_PATH, questions)
+    df = _count_frame('question_type', 'Question Type', data_key, questions)
+    
+    # Build the chart, reusing the figure while the question bank is unchanged
+    fig = _type_pie_chart(data_key, df)
+    
     st.plotly_chart(fig, use_container_width=True)
     
     # Display counts in a table as well
@@ -103,46 +263,12 @@ def display_topics_subtopics(tagged_data=None):
     
     st.markdown(f"### Course: {tagged_data.get('course_name', 'Unknown')}")
     
-    # Create a dictionary to store topic counts
-    topic_counts = {}
-    subtopic_details = {}
+    # Count questions per topic and subtopic, reusing the counts while the tags are unchanged
+    data_key = _data_key(TAGGED_QUESTIONS_PATH, tagged_data['topics'])
+    topic_counts, subtopic_details, topics_df = _topic_frames(data_key, tagged_data)
     
-    for topic in tagged_data['topics']:
-        topic_name = topic['name']
-        subtopics = topic['subtopics']
-        
-        # Count questions in this topic
-        total_questions = sum(len(subtopic['questions']) for subtopic in subtopics)
-        topic_counts[topic_name] = total_questions
-        
-        # Store subtopic details
-        subtopic_details[topic_name] = {}
-        for subtopic in subtopics:
-            subtopic_name = subtopic['name']
-            subtopic_details[topic_name][subtopic_name] = len(subtopic['questions'])
-    
-    # Create a DataFrame for topic counts
-    topics_df = pd.DataFrame({
-        'Topic': list(topic_counts.keys()),
-        'Question Count': list(topic_counts.values())
-    }).sort_values('Question Count', ascending=False)
-    
-    # Display topic counts in a bar chart
-    fig = px.bar(
-        topics_df, 
-        x='Topic', 
-        y='Question Count',
-        title='Questions by Topic',
-        color='Topic',
-        color_discrete_sequence=px.colors.qualitative.Pastel
-    )
-    
-    fig.update_layout(
-        xaxis_title="Topic",
-        yaxis_title="Number of Questions",
-        autosize=True,
-        margin=dict(l=20, r=20, t=40, b=20),
-    )
+    # Display topic counts in a bar chart, reusing the figure while the tags are unchanged
+    fig = _topic_bar_chart(data_key, topics_df)
     
     st.plotly_chart(fig, use_container_width=True)
     
@@ -151,13 +277,7 @@ def display_topics_subtopics(tagged_data=None):
     
     for topic_name, count in topic_counts.items():
         with st.expander(f"{topic_name} ({count} questions)"):
-            subtopics = subtopic_details[topic_name]
-            subtopics_df = pd.DataFrame({
-                'Subtopic': list(subtopics.keys()),
-                'Question Count': list(subtopics.values())
-            }).sort_values('Question Count', ascending=False)
-            
-            st.dataframe(subtopics_df)
+            st.dataframe(subtopic_details[topic_name])
 
 def display_source_distribution(questions):
     """
@@ -170,31 +290,11 @@ def display_source_distribution(questions):
         st.warning("No question data available")
         return
     
-    # Count source files
-    source_files = [q.get('source_file', 'Unknown') for q in questions]
-    source_counts = Counter(source_files)
-    
-    # Create a DataFrame for the plot
-    df = pd.DataFrame({
-        'Source File': list(source_counts.keys()),
-        'Count': list(source_counts.values())
-    }).sort_values('Count', ascending=False)
-    
-    # Create a bar chart
-    fig = px.bar(
-        df, 
-        x='Source File', 
-        y='Count',
-        title='Questions by Source File',
-        color='Source File',
-        color_discrete_sequence=px.colors.qualitative.Pastel
-    )
+    # Count source files, reusing the counts while the question bank is unchanged
+    data_key = _data_key(QUESTION_BANK_PATH, questions)
+    df = _count_frame('source_file', 'Source File', data_key, questions)
     
-    fig.update_layout(
-        xaxis_title="Source File",
-        yaxis_title="Number of Questions",
-        autosize=True,
-        margin=dict(l=20, r=20, t=40, b=20),
-    )
+    # Build the chart, reusing the figure while the question bank is unchanged
+    fig = _source_bar_chart(data_key, df)
     
     st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file
@@ -1,10 +1,20 @@
 import os
-import json
+import re
+import orjson
 import asyncio
+import argparse
 from pathlib import Path
 import anthropic
 
 
+# Matches one three-line question block of Claude's response, capturing all three fields at once
+_QUESTION_BLOCK_RE = re.compile(
+    r'^[ \t]*question_start:(.*)\n[ \t]*question_type:(.*)\n[ \t]*sub_questions_independent:(.*)$',
+    re.MULTILINE
+)
+_INDEPENDENT_VALUES = {"true": True, "false": False}
+
+
 class BatchRetriever:
     def __init__(self, batch_id, api_key=None, ocr_results_dir=None):
         """
@@ -18,8 +28,8 @@ class BatchRetriever:
         self.batch_id = batch_id
         self.api_key = api_key if api_key else os.environ.get("ANTHROPIC_API_KEY")
         
-        # Initialize the Claude client
-        self.client = anthropic.Anthropic(api_key=self.api_key)
+        # Initialize the async Claude client so result downloads do not block the event loop
+        self.client = anthropic.AsyncAnthropic(api_key=self.api_key)
         
         # Set up output directory
         if ocr_results_dir:
@@ -70,35 +80,15 @@ class BatchRetriever:
             dict: Structured dictionary with question information
         """
         result = {}
-        question_num = 1
         
-        # Split the response by double newlines to get each question block
-        blocks = response.strip().split('\n\n')
-        
-        for block in blocks:
-            lines = block.strip().split('\n')
-            if len(lines) != 3:
-                continue  # Skip invalid blocks
-                
-            question_data = {}
-            for line in lines:
-                if line.startswith("question_start:"):
-                    question_data["question_start"] = line.replace("question_start:", "").strip()
-                elif line.startswith("question_type:"):
-                    question_data["question_type"] = line.replace("question_type:", "").strip()
-                elif line.startswith("sub_questions_independent:"):
-                    value = line.replace("sub_questions_independent:", "").strip()
-                    if value.lower() == "true":
-                        question_data["sub_questions_independent"] = True
-                    elif value.lower() == "false":
-                        question_data["sub_questions_independent"] = False
-                    else:
-                        question_data["sub_questions_independent"] = None
-            
-            # Only add if we have all three fields
-            if len(question_data) == 3:
-                result[str(question_num)] = question_data
-                question_num += 1
+        # Match every question block in one pass of the compiled regex
+        for question_num, match in enumerate(_QUESTION_BLOCK_RE.finditer(response), 1):
+            question_start, question_type, independent = match.groups()
+            result[str(question_num)] = {
+                "question_start": question_start.strip(),
+                "question_type": question_type.strip(),
+                "sub_questions_independent": _INDEPENDENT_VALUES.get(independent.strip().lower())
+            }
             
         return result
     
@@ -121,9 +111,8 @@ class BatchRetriever:
             output_dir = os.path.dirname(file_path)
             output_file = os.path.join(output_dir, f"{file_base_name}_post1.json")
             
-            # Save the result as JSON
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(result, f, indent=2)
+            # Save the result as JSON, encoded by orjson
+            Path(output_file).write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2))
             
             print(f"Successfully saved result to {output_file}")
             return True
@@ -131,10 +120,14 @@ class BatchRetriever:
             print(f"Error saving result for {file_path}: {str(e)}")
             return False
     
-    async def retrieve_batch(self):
+    async def retrieve_batch(self, mapping=None):
         """
         Retrieve and process the results from a completed batch.
         
+        Args:
+            mapping (dict): Optional map of custom_id to .mmd file path; when given, results
+                are saved without prompting for their file paths
+            
         Returns:
             tuple: (success count, failure count)
         """
@@ -144,7 +137,7 @@ class BatchRetriever:
         
         try:
             # Check the batch status first
-            batch_status = self.client.messages.batches.retrieve(self.batch_id)
+            batch_status = await self.client.messages.batches.retrieve(self.batch_id)
             print(f"Batch {self.batch_id} status: {batch_status.processing_status}")
             print(f"Counts: {batch_status.request_counts}")
             
@@ -159,89 +152,100 @@ class BatchRetriever:
             debug_dir = os.path.join(os.path.dirname(os.path.dirname(self.ocr_results_dir)), "debug_results")
             os.makedirs(debug_dir, exist_ok=True)
             
-            # Stream the results from the batch
-            for result in self.client.messages.batches.results(self.batch_id):
-                custom_id = result.custom_id
-                
-                # Print result info for debugging
-                print(f"\nResult for {custom_id}:")
-                print(f"Result type: {result.result.type}")
-                
-                if result.result.type == "succeeded":
-                    try:
-                        # Extract text content from the message
-                        message = result.result.message
-                        
-                        # Extract the text content
-                        content_text = self._extract_text_from_content(message.content)
-                        
-                        # Parse the response
-                        parsed_result = self._parse_claude_response(content_text)
-                        
-                        print(f"Parsed {len(parsed_result)} questions from result")
-                        
-                        # For demonstration purposes, print the first question
-                        if parsed_result and "1" in parsed_result:
-                            print(f"First question: {parsed_result['1']}")
-                        
-                        # Store the result for later processing
-                        file_results.append({
-                            "custom_id": custom_id,
-                            "content_text": content_text,
-                            "parsed_result": parsed_result
-                        })
+            # Stream the results from the batch, writing the raw text content to the debug file as it arrives
+            with open(os.path.join(debug_dir, f"batch_{self.batch_id}_content.txt"), 'w', encoding='utf-8', buffering=1 << 20) as debug_fh:
+                async for result in await self.client.messages.batches.results(self.batch_id):
+                    custom_id = result.custom_id
+                    
+                    # Print result info for debugging
+                    print(f"\nResult for {custom_id}:")
+                    print(f"Result type: {result.result.type}")
+                    
+                    if result.result.type == "succeeded":
+                        try:
+                            # Extract text content from the message
+                            message = result.result.message
+                            
+                            # Extract the text content
+                            content_text = self._extract_text_from_content(message.content)
+                            
+                            # Parse the response
+                            parsed_result = self._parse_claude_response(content_text)
+                            
+                            print(f"Parsed {len(parsed_result)} questions from result")
+                            
+                            # For demonstration purposes, print the first question
+                            if parsed_result and "1" in parsed_result:
+                                print(f"First question: {parsed_result['1']}")
+                            
+                            # Write the raw content out now and keep only the parsed result for later processing
+                            debug_fh.write(f"=== {custom_id} ===\n{content_text}\n\n")
+                            file_results.append({
+                                "custom_id": custom_id,
+                                "parsed_result": parsed_result
+                            })
+                            
+                            success_count += 1
+                        except Exception as e:
+                            print(f"Error parsing result for {custom_id}: {str(e)}")
+                            failure_count += 1
+                    else:
+                        # Handle error cases
+                        error_type = result.result.type
+                        error_message = ""
+                        if error_type == "errored" and hasattr(result.result, "error"):
+                            error_message = result.result.error.message if hasattr(result.result.error, "message") else str(result.result.error)
                         
-                        success_count += 1
-                    except Exception as e:
-                        print(f"Error parsing result for {custom_id}: {str(e)}")
+                        print(f"Failed to process {custom_id}: {error_type} - {error_message}")
                         failure_count += 1
-                else:
-                    # Handle error cases
-                    error_type = result.result.type
-                    error_message = ""
-                    if error_type == "errored" and hasattr(result.result, "error"):
-                        error_message = result.result.error.message if hasattr(result.result.error, "message") else str(result.result.error)
-                    
-                    print(f"Failed to process {custom_id}: {error_type} - {error_message}")
-                    failure_count += 1
-            
-            # Save raw debug output of just the text content and parsed results
-            with open(os.path.join(debug_dir, f"batch_{self.batch_id}_content.txt"), 'w', encoding='utf-8') as f:
-                for result in file_results:
-                    f.write(f"=== {result['custom_id']} ===\n")
-                    f.write(result['content_text'])
-                    f.write("\n\n")
             
             # Now let's process and save each result
             print("\n\nNow we'll process and save each result.")
             print(f"We have {len(file_results)} successful results to save.")
             
+            # Ask for every file path first, then save all the results together
+            pending_saves = []
+            mmd_candidates = None  # .mmd files under the OCR results, listed once on first use
             for i, result_data in enumerate(file_results):
                 print(f"\nProcessing result {i+1}/{len(file_results)} (from {result_data['custom_id']}):")
                 
+                # Take the file path from the mapping when one was given
+                if mapping is not None:
+                    file_path = mapping.get(result_data['custom_id'])
+                    if not file_path:
+                        print("No file path in the mapping, skipping this result.")
+                        continue
+                    pending_saves.append((file_path, result_data['parsed_result']))
+                    continue
+                
                 # Get file path from user
                 file_path = input(f"Enter the file path for {result_data['custom_id']}: ").strip()
                 
                 if not file_path:
-                    # Try to auto-detect
-                    for root, _, files in os.walk(self.ocr_results_dir):
-                        for file in files:
-                            if file.endswith('.mmd'):
-                                path = os.path.join(root, file)
-                                print(f"Found .mmd file: {path}")
-                                choice = input("Use this file? (y/n): ").strip().lower()
-                                if choice == 'y':
-                                    file_path = path
-                                    break
-                        if file_path:
+                    # Try to auto-detect from the cached listing instead of walking the tree again
+                    if mmd_candidates is None:
+                        mmd_candidates = sorted(Path(self.ocr_results_dir).rglob('*.mmd'))
+                    
+                    for path in mmd_candidates:
+                        print(f"Found .mmd file: {path}")
+                        choice = input("Use this file? (y/n): ").strip().lower()
+                        if choice == 'y':
+                            file_path = str(path)
                             break
                 
                 if not file_path:
                     print("No file path provided, skipping this result.")
                     continue
                 
-                # Save the result
-                if self._save_result(file_path, result_data['parsed_result']):
+                pending_saves.append((file_path, result_data['parsed_result']))
+            
+            # Save the results concurrently in worker threads
+            saved = await asyncio.gather(
+                *(asyncio.to_thread(self._save_result, file_path, parsed_result) 
+                  for file_path, parsed_result in pending_saves)
+            )
+            for (file_path, _), ok in zip(pending_saves, saved):
+                if ok:
                     print(f"Successfully saved result for {file_path}")
                 else:
                     print(f"Failed to save result for {file_path}")
@@ -255,9 +259,28 @@ class BatchRetriever:
             return 0, 0
 
 
+def load_mapping(mapping_path):
+    """
+    Load a JSON file mapping custom_ids to .mmd file paths.
+    
+    Args:
+        mapping_path (str): Path to the mapping file
+        
+    Returns:
+        dict: Map of custom_id to file path
+    """
+    return orjson.loads(Path(mapping_path).read_bytes())
+
+
 async def main():
-    # Get batch ID from user
-    batch_id = input("Enter the batch ID to retrieve: ").strip()
+    # Set up command line argument parsing
+    parser = argparse.ArgumentParser(description="Retrieve and save the results of a Claude message batch")
+    parser.add_argument("batch_id", nargs="?", help="The batch ID to retrieve (prompted for if omitted)")
+    parser.add_argument("--mapping", "-m", help="JSON file mapping custom_id to .mmd file path, to save without prompts")
+    args = parser.parse_args()
+    
+    # Get batch ID from the arguments or the user
+    batch_id = args.batch_id or input("Enter the batch ID to retrieve: ").strip()
     
     if not batch_id:
         print("No batch ID provided, exiting.")
@@ -267,7 +290,8 @@ async def main():
     retriever = BatchRetriever(batch_id)
     
     # Process the batch
-    success, failed = await retriever.retrieve_batch()
+    mapping = load_mapping(args.mapping) if args.mapping else None
+    success, failed = await retriever.retrieve_batch(mapping)
     print(f"\nBatch retrieval completed: {success} successful results processed, {failed} failed")
 
 
@@ -1,8 +1,11 @@
 import httpx
 import asyncio
 import json
+import orjson
 import os
 import argparse
+import importlib.util
+import random
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -16,7 +19,19 @@ if not app_key:
 
 BASE_URL = "https://api.mathpix.com/v3/pdf"
 
-async def download_formats(pdf_id, output_dir, formats=None):
+def create_client():
+    """
+    Creates the HTTP client shared by every request made for a PDF, so the connection
+    and TLS session are reused (over HTTP/2 when h2 is installed).
+    """
+    return httpx.AsyncClient(
+        http2=importlib.util.find_spec("h2") is not None, 
+        timeout=30.0, 
+        limits=httpx.Limits(max_connections=10),
+        headers={"app_key": app_key}
+    )
+
+async def download_formats(client, pdf_id, output_dir, formats=None):
     """
     Downloads available formats for a PDF given its ID.
     """
@@ -34,121 +49,141 @@ async def download_formats(pdf_id, output_dir, formats=None):
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
-    # Download each format
-    successful_downloads = 0
     total_formats = len(formats)
     
-    for format_info in formats:
+    async def _fetch_one(format_info):
         ext = format_info["ext"]
         is_binary = format_info["binary"]
         
         url = f"{BASE_URL}/{pdf_id}.{ext}"
-        headers = {"app_key": app_key}
         
         print(f"Requesting {ext} format...")
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url, headers=headers)
+            response = await client.get(url)
+            
+            if response.status_code == 200:
+                # Determine the output filename
+                output_filename = f"{pdf_id}.{ext}"
+                if ext == "tex":
+                    output_filename = f"{pdf_id}.tex.zip"
+                
+                output_path = os.path.join(output_dir, output_filename)
                 
-                if response.status_code == 200:
-                    # Determine the output filename
-                    output_filename = f"{pdf_id}.{ext}"
-                    if ext == "tex":
-                        output_filename = f"{pdf_id}.tex.zip"
-                    
-                    output_path = os.path.join(output_dir, output_filename)
-                    
-                    # Save the content
-                    if is_binary:
-                        with open(output_path, "wb") as f:
-                            f.write(response.content)
-                    else:
-                        with open(output_path, "w", encoding="utf-8") as f:
-                            f.write(response.text)
-                    
-                    print(f"✓ Downloaded {ext} format to {output_path}")
-                    successful_downloads += 1
+                # Save the content in a worker thread so the other downloads keep going
+                if is_binary:
+                    await asyncio.to_thread(Path(output_path).write_bytes, response.content)
                 else:
-                    print(f"✗ Failed to download {ext} format: {response.status_code}")
-                    print(response.text)
-            
+                    await asyncio.to_thread(Path(output_path).write_text, response.text, encoding="utf-8")
+                
+                print(f"✓ Downloaded {ext} format to {output_path}")
+                return ext, True
+            else:
+                print(f"✗ Failed to download {ext} format: {response.status_code}")
+                print(response.text)
+                return ext, False
+        
         except Exception as e:
             print(f"✗ Error downloading {ext} format: {e}")
+            return ext, False
+    
+    # Download every format concurrently over the shared client
+    results = await asyncio.gather(
+        *[_fetch_one(format_info) for format_info in formats], 
+        return_exceptions=True
+    )
+    
+    successful_downloads = sum(1 for result in results if not isinstance(result, Exception) and result[1])
     
     print(f"\nDownload summary: {successful_downloads}/{total_formats} formats downloaded successfully")
     return successful_downloads > 0
 
-async def check_processing_status(pdf_id):
+async def check_processing_status(client, pdf_id):
     """
     Checks if processing is complete for the PDF.
     """
     url = f"{BASE_URL}/{pdf_id}"
-    headers = {"app_key": app_key}
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            if response.status_code == 200:
-                status_data = response.json()
-                status = status_data.get("status")
-                print(f"PDF processing status: {status}")
-                return status == "completed"
-            else:
-                print(f"Failed to check status: {response.status_code}")
-                return False
+        response = await client.get(url)
+        if response.status_code == 200:
+            status_data = response.json()
+            status = status_data.get("status")
+            print(f"PDF processing status: {status}")
+            return status == "completed"
+        else:
+            print(f"Failed to check status: {response.status_code}")
+            return False
     except Exception as e:
         print(f"Error checking status: {e}")
         return False
 
-async def download_stream_results(pdf_id, output_dir):
+async def iter_stream_lines(response):
+    """
+    Yields the raw lines of a streaming response as bytes, without decoding them to text.
+    """
+    buffer = bytearray()
+    async for chunk in response.aiter_bytes(chunk_size=64 * 1024):
+        buffer.extend(chunk)
+        start = 0
+        while (newline := buffer.find(b"\n", start)) != -1:
+            yield bytes(buffer[start:newline])
+            start = newline + 1
+        if start:
+            del buffer[:start]
+    
+    if buffer:
+        yield bytes(buffer)
+
+def write_stream_results(results, output_dir, pdf_id):
+    """
+    Writes the streamed JSON chunks and the MMD content extracted from them.
+    """
+    # Save JSON
+    json_path = os.path.join(output_dir, f"{pdf_id}_results.json")
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved streaming results to {json_path}")
+    
+    # Extract and save MMD content, collecting the parts instead of growing one string
+    mmd_parts = [chunk['text'] for chunk in results if chunk.get('text')]
+    
+    if mmd_parts:
+        mmd_path = os.path.join(output_dir, f"{pdf_id}_stream.mmd")
+        with open(mmd_path, 'w', encoding='utf-8') as f:
+            f.writelines(mmd_parts)
+        print(f"Saved extracted MMD content to {mmd_path}")
+
+async def download_stream_results(client, pdf_id, output_dir):
     """
     Downloads streaming results for a PDF.
     """
     url = f"{BASE_URL}/{pdf_id}/stream"
-    headers = {"app_key": app_key}
     
     print(f"Downloading streaming results for PDF ID: {pdf_id}")
     results = []
     
     try:
-        async with httpx.AsyncClient(timeout=httpx.Timeout(timeout=None)) as client:
-            async with client.stream("GET", url, headers=headers) as response:
-                if response.status_code == 200:
-                    print("Connected to the stream!")
-                    async for line in response.aiter_lines():
-                        if line.strip():  # Ignore empty lines
-                            try:
-                                data = json.loads(line)
-                                results.append(data)
-                                print(".", end="", flush=True)  # Progress indicator
-                            except json.JSONDecodeError:
-                                print(f"Failed to decode line: {line}")
-                    print("\nStream download complete!")
-                else:
-                    print(f"Failed to connect to stream: {response.status_code}")
-                    return False
-        
-        # Save the results
+        # The stream stays open until Mathpix finishes, so it must not time out
+        async with client.stream("GET", url, timeout=httpx.Timeout(None)) as response:
+            if response.status_code == 200:
+                print("Connected to the stream!")
+                async for line in iter_stream_lines(response):
+                    if line.strip():  # Ignore empty lines
+                        try:
+                            data = orjson.loads(line)
+                            results.append(data)
+                            print(".", end="", flush=True)  # Progress indicator
+                        except ValueError:
+                            print(f"Failed to decode line: {line.decode('utf-8', 'replace')}")
+                print("\nStream download complete!")
+            else:
+                print(f"Failed to connect to stream: {response.status_code}")
+                return False
+    
+        # Save the results in a worker thread so the event loop is not blocked on disk writes
         if results:
-            # Save JSON
-            json_path = os.path.join(output_dir, f"{pdf_id}_results.json")
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(results, f, indent=2)
-            print(f"Saved streaming results to {json_path}")
-            
-            # Extract and save MMD content
-            mmd_content = ""
-            for chunk in results:
-                if 'text' in chunk:
-                    mmd_content += chunk['text']
-            
-            if mmd_content:
-                mmd_path = os.path.join(output_dir, f"{pdf_id}_stream.mmd")
-                with open(mmd_path, 'w', encoding='utf-8') as f:
-                    f.write(mmd_content)
-                print(f"Saved extracted MMD content to {mmd_path}")
-            
+            await asyncio.to_thread(write_stream_results, results, output_dir, pdf_id)
             return True
         else:
             print("No streaming results found")
@@ -164,44 +199,52 @@ async def main():
     parser.add_argument("--output-dir", "-o", default="results", help="Directory to save results (default: 'results')")
     parser.add_argument("--wait", "-w", action="store_true", help="Wait for processing to complete if not already done")
     parser.add_argument("--stream", "-s", action="store_true", help="Download streaming results")
+    parser.add_argument("--timeout", "-t", type=float, default=60, help="Seconds to wait for processing with --wait (default: 60)")
     args = parser.parse_args()
     
     # Create specific output directory for this PDF ID
     output_dir = os.path.join(args.output_dir, args.pdf_id)
     os.makedirs(output_dir, exist_ok=True)
     
-    # Check if processing is complete
-    is_complete = await check_processing_status(args.pdf_id)
-    
-    # Wait for processing if requested and not complete
-    if args.wait and not is_complete:
-        print("Waiting for processing to complete...")
-        max_attempts = 12
-        delay = 5  # seconds
+    # Use one client for the status polls and every download
+    async with create_client() as client:
+        # Check if processing is complete
+        is_complete = await check_processing_status(client, args.pdf_id)
         
-        for attempt in range(1, max_attempts + 1):
-            print(f"Attempt {attempt}/{max_attempts}... ", end="")
-            is_complete = await check_processing_status(args.pdf_id)
+        # Wait for processing if requested and not complete
+        if args.wait and not is_complete:
+            print("Waiting for processing to complete...")
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + args.timeout
+            delay = 1.0  # seconds, doubled after every poll up to 30
+            attempt = 0
             
-            if is_complete:
-                print("Processing completed!")
-                break
-            else:
-                print(f"Still processing. Waiting {delay} seconds...")
-                await asyncio.sleep(delay)
+            # Poll with exponential backoff and jitter until processing completes or the timeout runs out
+            while not is_complete and loop.time() < deadline:
+                wait = min(delay + random.uniform(0, 0.2 * delay), deadline - loop.time())
+                print(f"Still processing. Waiting {wait:.1f} seconds...")
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, 30)
+                
+                attempt += 1
+                print(f"Attempt {attempt}... ", end="")
+                is_complete = await check_processing_status(client, args.pdf_id)
+                
+                if is_complete:
+                    print("Processing completed!")
+            
+            if not is_complete:
+                print("Timed out waiting for processing to complete.")
+                print("Will try to download available formats anyway.")
         
-        if not is_complete:
-            print("Timed out waiting for processing to complete.")
-            print("Will try to download available formats anyway.")
-    
-    # Download results
-    if args.stream:
-        await download_stream_results(args.pdf_id, output_dir)
-    
-    # Always attempt to download the format files
-    await download_formats(args.pdf_id, output_dir)
-    
-    print(f"\nAll available results downloaded to {output_dir}")
+        # Download results
+        if args.stream:
+            await download_stream_results(client, args.pdf_id, output_dir)
+        
+        # Always attempt to download the format files
+        await download_formats(client, args.pdf_id, output_dir)
+        
+        print(f"\nAll available results downloaded to {output_dir}")
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -3,6 +3,7 @@ import asyncio
 import json
 import os
 import argparse
+import importlib.util
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -15,39 +16,48 @@ if not app_key:
 
 BASE_URL = "https://api.mathpix.com/v3/pdf"
 
-async def check_processing_status(pdf_id):
+def create_client():
+    """
+    Creates the HTTP client shared by the Mathpix requests, so the connection and TLS
+    session are reused (over HTTP/2 when h2 is installed).
+    """
+    return httpx.AsyncClient(
+        http2=importlib.util.find_spec("h2") is not None, 
+        timeout=30.0, 
+        headers={"app_key": app_key}
+    )
+
+async def check_processing_status(client, pdf_id):
     """
     Checks the processing status of a PDF given its ID.
     """
     url = f"{BASE_URL}/{pdf_id}"
-    headers = {"app_key": app_key}
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            if response.status_code == 200:
-                status_data = response.json()
-                print(f"Status for PDF ID {pdf_id}:")
-                print(f"- Status: {status_data.get('status')}")
-                print(f"- Progress: {status_data.get('progress', 'N/A')}")
-                if status_data.get('error'):
-                    print(f"- Error: {status_data.get('error')}")
-                
-                # Print available conversion formats if completed
-                if status_data.get('status') == 'completed':
-                    print("\nAvailable conversion formats:")
-                    for format_type in status_data.get('conversion_formats', {}):
-                        print(f"- {format_type}")
-                
-                # Pretty print the full response for detailed inspection
-                print("\nFull response:")
-                print(json.dumps(status_data, indent=2))
-                
-                return status_data
-            else:
-                print(f"Failed to check status: {response.status_code}")
-                print(response.text)
-                return None
+        response = await client.get(url)
+        if response.status_code == 200:
+            status_data = response.json()
+            print(f"Status for PDF ID {pdf_id}:")
+            print(f"- Status: {status_data.get('status')}")
+            print(f"- Progress: {status_data.get('progress', 'N/A')}")
+            if status_data.get('error'):
+                print(f"- Error: {status_data.get('error')}")
+            
+            # Print available conversion formats if completed
+            if status_data.get('status') == 'completed':
+                print("\nAvailable conversion formats:")
+                for format_type in status_data.get('conversion_formats', {}):
+                    print(f"- {format_type}")
+            
+            # Pretty print the full response for detailed inspection
+            print("\nFull response:")
+            print(json.dumps(status_data, indent=2))
+            
+            return status_data
+        else:
+            print(f"Failed to check status: {response.status_code}")
+            print(response.text)
+            return None
     except Exception as e:
         print(f"Error checking status: {e}")
         return None
@@ -62,7 +72,8 @@ async def main():
     pdf_id = args.pdf_id
     
     # Check the status
-    await check_processing_status(pdf_id)
+    async with create_client() as client:
+        await check_processing_status(client, pdf_id)
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file